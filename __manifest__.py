@@ -1,6 +1,6 @@
 {
     "name": "Account Move Operations",
-    "version": "saas~18.2.1.0.0",
+    "version": "saas~18.2.1.1.0",
     "category": "Accounting",
     "summary": "Templates for recurring accounting operations",
     "author": "Vauxoo",
@@ -20,6 +20,8 @@
         "views/account_move_operation_views.xml",
         "views/account_move_operation_line_views.xml",
         "views/account_move_views.xml",
+        "views/account_move_operation_job_views.xml",
+        "views/account_bank_statement_line_views.xml",
         # # "views/bank_rec_widget_views.xml",
         # # Wizard
         # "wizard/account_invoice_template_run_view.xml",
@@ -28,9 +30,11 @@
         # "wizard/account_move_operation_reconcile_view.xml",
         "wizard/account_move_operation_operation_view.xml",
         "wizard/account_move_operation_from_entry_view.xml",
+        "wizard/account_move_operation_from_entry_batch_view.xml",
         # "wizard/account_bank_statement_operation_view.xml",
         # Data
         "data/ir_sequence_data.xml",
+        "data/ir_cron_data.xml",
     ],
     "demo": [
         "demo/res_company.xml",
@@ -39,11 +43,12 @@
         "demo/product.xml",
         "demo/account_move_template.xml",
         "demo/account_move_operation_type.xml",
+        "demo/account_move_operation.xml",
     ],
-    # "assets": {
-    #     "web.assets_backend": [
-    #         "account_move_operation/static/src/components/**/*",
-    #     ],
-    # },
+    "assets": {
+        "web.assets_backend": [
+            "account_move_operation/static/src/components/**/*",
+        ],
+    },
     "installable": True,
 }
@@ -0,0 +1,124 @@
+import logging
+
+from odoo import SUPERUSER_ID, api
+
+_logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 100000
+
+
+def migrate(cr, version):
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    _migrate_sequence_implementation(env)
+    _migrate_last_document_date(cr)
+    _migrate_move_operation(cr)
+    _migrate_operation_date(cr)
+    _migrate_last_transition(cr)
+
+
+def _migrate_sequence_implementation(env):
+    """Operation numbers no longer lock the sequence row while a transaction
+    is running, existing databases switch their sequence accordingly."""
+    sequence = env.ref(
+        "account_move_operation.seq_account_move_operation", raise_if_not_found=False
+    )
+    if sequence and sequence.implementation != "standard":
+        sequence.implementation = "standard"
+
+
+def _migrate_last_document_date(cr):
+    """Fill the date of the latest document of the running operations from the
+    last step of each operation that has a document attached."""
+    cr.execute(
+        """
+        UPDATE account_move_operation operation
+           SET last_document_date = latest.date
+          FROM (
+                SELECT DISTINCT ON (line.operation_id)
+                       line.operation_id,
+                       COALESCE(st_move.date, move.date, payment.date) AS date
+                  FROM account_move_operation_line line
+             LEFT JOIN account_bank_statement_line st_line ON st_line.id = line.st_line_id
+             LEFT JOIN account_move st_move ON st_move.id = st_line.move_id
+             LEFT JOIN account_move move ON move.id = line.move_id
+             LEFT JOIN account_payment payment ON payment.id = line.payment_id
+                 WHERE COALESCE(line.st_line_id, line.move_id, line.payment_id) IS NOT NULL
+              ORDER BY line.operation_id, line.step DESC
+               ) latest
+         WHERE operation.id = latest.operation_id
+           AND operation.state = 'in_progress'
+        """
+    )
+
+
+def _migrate_move_operation(cr):
+    """Link the journal entries to the first operation that created them.
+
+    The link used to be a stored compute, which could be left stale. It is
+    rebuilt in chunks of operation lines, so the updates on ``account_move``
+    stay short on large databases.
+    """
+    cr.execute("SELECT MIN(id), MAX(id) FROM account_move_operation_line")
+    min_id, max_id = cr.fetchone()
+    if min_id is None:
+        return
+
+    for start in range(min_id, max_id + 1, CHUNK_SIZE):
+        cr.execute(
+            """
+            UPDATE account_move move
+               SET operation_id = first_line.operation_id
+              FROM (
+                    SELECT DISTINCT ON (line.move_id) line.move_id, line.operation_id
+                      FROM account_move_operation_line line
+                     WHERE line.move_id IS NOT NULL
+                       AND line.id >= %s
+                       AND line.id < %s
+                       AND NOT EXISTS (
+                            SELECT 1
+                              FROM account_move_operation_line earlier
+                             WHERE earlier.move_id = line.move_id
+                               AND earlier.id < %s
+                           )
+                  ORDER BY line.move_id, line.id
+                   ) first_line
+             WHERE move.id = first_line.move_id
+               AND move.operation_id IS DISTINCT FROM first_line.operation_id
+            """,
+            (start, start + CHUNK_SIZE, start),
+        )
+        _logger.info(
+            "Linked %s journal entries to their operation (lines %s to %s)",
+            cr.rowcount,
+            start,
+            min(start + CHUNK_SIZE, max_id + 1) - 1,
+        )
+
+
+def _migrate_operation_date(cr):
+    """Date the existing operations by their creation instead of the day of
+    the upgrade."""
+    cr.execute(
+        """
+        UPDATE account_move_operation
+           SET date = create_date::date
+         WHERE create_date IS NOT NULL
+        """
+    )
+
+
+def _migrate_last_transition(cr):
+    """Date the last transition of the existing operations by the last change
+    of their steps instead of the day of the upgrade."""
+    cr.execute(
+        """
+        UPDATE account_move_operation operation
+           SET date_last_transition = latest.write_date
+          FROM (
+                SELECT operation_id, MAX(write_date) AS write_date
+                  FROM account_move_operation_line
+              GROUP BY operation_id
+               ) latest
+         WHERE operation.id = latest.operation_id
+        """
+    )
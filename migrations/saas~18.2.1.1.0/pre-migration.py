@@ -0,0 +1,41 @@
+from odoo.tools.sql import column_exists, create_column
+
+
+def migrate(cr, version):
+    _migrate_step_order(cr)
+
+
+def _migrate_step_order(cr):
+    """Rebuild the step order from the former orig/dest chain.
+
+    Lines used to be linked to each other through ``orig_line_id``. Those links
+    were rewritten when splicing sub operations and could end up broken, so the
+    step of each line is taken from its creation order inside the operation,
+    which is the order the chain was built in. Sub operations get an explicit
+    link to the line that created them.
+    """
+    if not column_exists(cr, "account_move_operation_line", "step"):
+        create_column(cr, "account_move_operation_line", "step", "int4")
+    cr.execute(
+        """
+        UPDATE account_move_operation_line line
+           SET step = ordered.step
+          FROM (
+                SELECT id,
+                       row_number() OVER (PARTITION BY operation_id ORDER BY id) AS step
+                  FROM account_move_operation_line
+               ) ordered
+         WHERE line.id = ordered.id
+        """
+    )
+
+    if not column_exists(cr, "account_move_operation", "parent_line_id"):
+        create_column(cr, "account_move_operation", "parent_line_id", "int4")
+    cr.execute(
+        """
+        UPDATE account_move_operation operation
+           SET parent_line_id = line.id
+          FROM account_move_operation_line line
+         WHERE line.created_operation_id = operation.id
+        """
+    )
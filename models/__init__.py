@@ -1,9 +1,11 @@
 from . import account_move
-# from . import account_move_template
+from . import account_move_template
 # from . import account_move_template_line
 from . import account_move_operation_action
 from . import account_move_operation_type
 from . import account_move_operation
 from . import account_move_operation_line
+from . import account_move_operation_job
+from . import ir_sequence
 # from . import bank_rec_widget
-# from . import account_bank_statement_line
+from . import account_bank_statement_line
@@ -0,0 +1,225 @@
+from collections import defaultdict
+
+from odoo import _, models
+from odoo.exceptions import UserError
+from odoo.tools import SQL
+from odoo.tools.sql import create_index
+
+
+class AccountBankStatementLine(models.Model):
+    _inherit = "account.bank.statement.line"
+
+    def init(self):
+        super().init()
+        create_index(
+            self.env.cr,
+            "account_bank_statement_line_operation_match_index",
+            self._table,
+            ["partner_id", "amount"],
+            where="is_reconciled IS NOT TRUE AND partner_id IS NOT NULL",
+        )
+
+    def action_create_operations(self):
+        operations = self._create_operations()
+        return {
+            "name": _("Account Operations"),
+            "view_mode": "list,form",
+            "res_model": "account.move.operation",
+            "domain": [("id", "in", operations.ids)],
+            "type": "ir.actions.act_window",
+        }
+
+    def _create_operations(self):
+        """Create and start an operation for every statement line matching the
+        rules of an operation type.
+
+        Lines without partner or already linked to an operation are skipped.
+        The types are tried by sequence, the first one whose rules match is
+        used.
+
+        :return: the created ``account.move.operation`` records
+        """
+        operation_obj = self.env["account.move.operation"]
+        linked_lines = operation_obj.search(
+            [("st_line_id", "in", self.ids), ("state", "!=", "cancel")]
+        ).st_line_id
+        st_lines = self.filtered("partner_id") - linked_lines
+        if not st_lines:
+            return operation_obj
+
+        operation_types = self.env["account.move.operation.type"].search(
+            [
+                ("from_bank_statement", "=", True),
+                ("sub_operation", "=", False),
+                ("company_id", "in", st_lines.company_id.ids + [False]),
+            ]
+        )
+        matchers = [
+            (operation_type, operation_type._get_statement_line_matcher())
+            for operation_type in operation_types
+        ]
+
+        vals_list = []
+        for st_line in st_lines:
+            operation_type = next(
+                (operation_type for operation_type, match in matchers if match(st_line)),
+                None,
+            )
+            if operation_type:
+                vals_list.append(st_line._prepare_operation_vals(operation_type))
+
+        operations = operation_obj.create(vals_list)
+        operations._start()
+        return operations
+
+    def _prepare_operation_vals(self, operation_type):
+        self.ensure_one()
+        return {
+            "operation_type_id": operation_type.id,
+            "st_line_id": self.id,
+            "partner_id": self.partner_id.id,
+            "currency_id": self.currency_id.id,
+            "amount": self.amount,
+            "reference": self.payment_ref,
+            "company_id": self.company_id.id,
+        }
+
+    def action_link_operation(self, operation_id):
+        """Link this statement line to one of its suggested operations and open
+        it, from the bank reconciliation widget."""
+        self.ensure_one()
+        operation = self.env["account.move.operation"].browse(operation_id)
+        if operation.st_line_id or operation.state not in ("draft", "in_progress"):
+            raise UserError(
+                _("Operation %s can not be linked to a bank statement line.", operation.name)
+            )
+
+        operation.st_line_id = self
+        return {
+            "name": _("Account Operation"),
+            "view_mode": "form",
+            "res_model": "account.move.operation",
+            "res_id": operation.id,
+            "type": "ir.actions.act_window",
+        }
+
+    def get_operation_suggestions(self, limit=5):
+        """Return the open operations most likely to belong to each statement
+        line, for the bank reconciliation widget.
+
+        :return: dict mapping the id of each line to the list of its candidates
+        """
+        candidates_by_line = self._get_operation_candidates_by_line(limit)
+        operations = self.env["account.move.operation"].union(
+            *candidates_by_line.values()
+        )
+        values = {
+            vals["id"]: vals
+            for vals in operations.read(
+                ["name", "operation_type_id", "partner_id", "date", "amount", "state"]
+            )
+        }
+        return {
+            st_line_id: [values[operation.id] for operation in candidates]
+            for st_line_id, candidates in candidates_by_line.items()
+        }
+
+    def _get_operation_candidates(self, limit=5):
+        self.ensure_one()
+        return self._get_operation_candidates_by_line(limit)[self.id]
+
+    def _get_operation_candidates_by_line(self, limit=5):
+        """Return the open operations not linked to a statement line that most
+        likely belong to each line, the closest amount and date first.
+
+        The candidates of all the lines are ranked and limited with a single
+        lateral query, each lookup going through the partial index on company,
+        partner, currency, date and amount of the operations.
+
+        :return: dict mapping the id of each line to its candidates
+        """
+        operation_obj = self.env["account.move.operation"]
+        result = dict.fromkeys(self.ids, operation_obj)
+        if not self:
+            return result
+
+        st_query = self._search([("id", "in", self.ids)])
+        st_sql = st_query.select(
+            *(
+                SQL(
+                    "%s AS %s",
+                    self._field_to_sql(st_query.table, fname, st_query),
+                    SQL.identifier(fname),
+                )
+                for fname in (
+                    "id",
+                    "company_id",
+                    "currency_id",
+                    "partner_id",
+                    "date",
+                    "amount",
+                )
+            )
+        )
+
+        def st_line_field(fname):
+            return SQL.identifier("st_line", fname)
+
+        query = operation_obj._search(
+            [("st_line_id", "=", False), ("state", "in", ("draft", "in_progress"))]
+        )
+
+        def operation_field(fname):
+            return operation_obj._field_to_sql(query.table, fname, query)
+
+        window = operation_obj._get_match_window().days
+        for fname in ("company_id", "currency_id"):
+            query.add_where(SQL("%s = %s", operation_field(fname), st_line_field(fname)))
+        query.add_where(
+            SQL(
+                "%s BETWEEN %s - %s AND %s + %s",
+                operation_field("date"),
+                st_line_field("date"),
+                window,
+                st_line_field("date"),
+                window,
+            )
+        )
+        query.add_where(
+            SQL(
+                "(%s IS NULL OR %s = %s)",
+                st_line_field("partner_id"),
+                operation_field("partner_id"),
+                st_line_field("partner_id"),
+            )
+        )
+        amount_gap = SQL(
+            "ABS(ABS(%s) - ABS(%s))", operation_field("amount"), st_line_field("amount")
+        )
+        date_gap = SQL("ABS(%s - %s)", operation_field("date"), st_line_field("date"))
+        query.order = SQL("%s, %s, %s", amount_gap, date_gap, operation_field("id"))
+        query.limit = limit
+        candidate_sql = query.select(
+            SQL("%s AS id", operation_field("id")),
+            SQL("%s AS amount_gap", amount_gap),
+            SQL("%s AS date_gap", date_gap),
+        )
+
+        rows = self.env.execute_query(
+            SQL(
+                """
+                SELECT st_line.id, candidate.id
+                  FROM (%s) st_line
+            CROSS JOIN LATERAL (%s) candidate
+              ORDER BY st_line.id, candidate.amount_gap, candidate.date_gap, candidate.id
+                """,
+                st_sql,
+                candidate_sql,
+            )
+        )
+        operation_ids = defaultdict(list)
+        for st_line_id, operation_id in rows:
+            operation_ids[st_line_id].append(operation_id)
+        for st_line_id, ids in operation_ids.items():
+            result[st_line_id] = operation_obj.browse(ids)
+        return result
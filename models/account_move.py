@@ -1,5 +1,5 @@
 # models/account_move.py (updated version)
-from odoo import models, fields, api, _
+from odoo import models, fields, _
 
 
 class AccountMove(models.Model):
@@ -15,33 +15,40 @@ class AccountMove(models.Model):
     operation_id = fields.Many2one(
         "account.move.operation",
         string="Source Operation",
-        compute="_compute_operation_id",
-        store=True,
+        readonly=True,
+        copy=False,
+        index="btree_not_null",
     )
 
-    @api.depends("operation_line_ids.operation_id")
-    def _compute_operation_id(self):
-        for move in self:
-            move.operation_id = move.operation_line_ids[:1].operation_id.id
-
     def action_post(self):
-        opertation_line_obj = self.env["account.move.operation.line"]
         res = super().action_post()
-        for rec in self.filtered(lambda am: am.state == "posted"):
-            line = opertation_line_obj.search(
+        posted_moves = self.filtered(lambda am: am.state == "posted")
+        if posted_moves:
+            lines = self.env["account.move.operation.line"].search(
                 [
+                    ("move_id", "in", posted_moves.ids),
                     ("action", "=", "move"),
                     ("state", "=", "in_progress"),
-                    ("move_id", "=", rec.id),
-                ],
-                limit=1,
+                ]
             )
-            if line:
-                line.action_done()
+            lines.action_done()
         return res
 
     def action_create_operation(self):
         """Open wizard to create an operation from this entry"""
+        if len(self) > 1:
+            return {
+                "name": _("Create Operations From Entries"),
+                "view_mode": "form",
+                "res_model": "account.move.operation.from.entry.batch",
+                "type": "ir.actions.act_window",
+                "context": {
+                    "active_model": self._name,
+                    "active_ids": self.ids,
+                },
+                "target": "new",
+            }
+
         self.ensure_one()
         return {
             "name": _("Create Operation From Entry"),
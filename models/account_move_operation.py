@@ -1,5 +1,10 @@
+from collections import defaultdict
+from datetime import timedelta
+
 from odoo import _, api, fields, models
 from odoo.exceptions import UserError
+from odoo.tools import SQL
+from odoo.tools.sql import create_index
 
 
 class AccountMoveOperation(models.Model):
@@ -83,6 +88,7 @@ class AccountMoveOperation(models.Model):
         readonly=True,
         tracking=True,
     )
+    date = fields.Date(default=fields.Date.context_today, copy=False)
     reference = fields.Char(copy=False)
     amount = fields.Monetary(currency_field="currency_id")
     from_bank_statement = fields.Boolean(
@@ -91,12 +97,72 @@ class AccountMoveOperation(models.Model):
     line_ids = fields.One2many(
         "account.move.operation.line", "operation_id", readonly=True
     )
+    current_line_id = fields.Many2one(
+        comodel_name="account.move.operation.line",
+        string="Current Step",
+        compute="_compute_progress",
+        store=True,
+        index="btree_not_null",
+        help="Step in progress or ready to be executed next.",
+    )
+    step_count = fields.Integer(
+        string="Steps",
+        compute="_compute_progress",
+        store=True,
+    )
+    step_done_count = fields.Integer(
+        string="Steps Done",
+        compute="_compute_progress",
+        store=True,
+    )
+    progress = fields.Float(
+        compute="_compute_progress",
+        store=True,
+        index=True,
+        aggregator="avg",
+    )
+    date_last_transition = fields.Datetime(
+        string="Last Transition",
+        readonly=True,
+        copy=False,
+        index=True,
+        help="Last time one of the steps changed state.",
+    )
+    last_document_date = fields.Date(
+        readonly=True,
+        copy=False,
+        help="Date of the latest document attached to a step of this operation "
+        "or of its sub operations.",
+    )
+    st_line_candidate_ids = fields.Many2many(
+        comodel_name="account.bank.statement.line",
+        string="Suggested Bank Statement Lines",
+        compute="_compute_st_line_candidate_ids",
+    )
+    job_ids = fields.One2many(
+        "account.move.operation.job", "operation_id", readonly=True
+    )
+    parent_line_id = fields.Many2one(
+        comodel_name="account.move.operation.line",
+        readonly=True,
+        copy=False,
+        index="btree_not_null",
+        help="Step of another operation that created this one as a sub operation.",
+    )
+
+    def init(self):
+        create_index(
+            self.env.cr,
+            "account_move_operation_st_line_match_index",
+            self._table,
+            ["company_id", "partner_id", "currency_id", "date", "amount"],
+            where="st_line_id IS NULL AND state IN ('draft', 'in_progress')",
+        )
 
     @api.model_create_multi
     def create(self, vals_list):
+        vals_by_sequence = defaultdict(list)
         for vals in vals_list:
-            if "company_id" in vals:
-                self = self.sudo().with_company(vals["company_id"])
             if vals.get("name", _("New")) == _("New"):
                 seq_date = (
                     fields.Datetime.context_timestamp(
@@ -105,11 +171,58 @@ class AccountMoveOperation(models.Model):
                     if "date" in vals
                     else None
                 )
-                vals["name"] = self.env["ir.sequence"].next_by_code(
-                    "account.move.operation", sequence_date=seq_date
-                ) or _("New")
+                company_id = vals.get("company_id") or self.env.company.id
+                vals_by_sequence[company_id, seq_date].append(vals)
+
+        sequence_obj = self.env["ir.sequence"].sudo()
+        for (company_id, seq_date), seq_vals_list in vals_by_sequence.items():
+            names = sequence_obj.with_company(company_id)._next_block_by_code(
+                "account.move.operation", len(seq_vals_list), sequence_date=seq_date
+            )
+            for vals, name in zip(seq_vals_list, names):
+                vals["name"] = name or _("New")
+
+        parent_lines = (
+            self.env["account.move.operation.line"]
+            .sudo()
+            .browse(
+                vals["parent_line_id"] for vals in vals_list if vals.get("parent_line_id")
+            )
+        )
+        dates = {line.id: line.operation_id.last_document_date for line in parent_lines}
+        for vals in vals_list:
+            if vals.get("parent_line_id") and "last_document_date" not in vals:
+                vals["last_document_date"] = dates[vals["parent_line_id"]]
         return super().create(vals_list)
 
+    @api.depends("line_ids.state")
+    def _compute_progress(self):
+        for operation in self:
+            lines = operation.line_ids
+            operation.current_line_id = lines.filtered(
+                lambda line: line.state == "in_progress"
+            )[:1] or lines.filtered(lambda line: line.state == "ready")[:1]
+            operation.step_count = len(lines)
+            operation.step_done_count = len(
+                lines.filtered(lambda line: line.state == "done")
+            )
+            operation.progress = (
+                100.0 * operation.step_done_count / operation.step_count
+                if operation.step_count
+                else 0.0
+            )
+
+    @api.depends(
+        "company_id", "partner_id", "currency_id", "amount", "date", "st_line_id", "state"
+    )
+    def _compute_st_line_candidate_ids(self):
+        for operation in self:
+            operation.st_line_candidate_ids = (
+                not operation.st_line_id
+                and operation.state in ("draft", "in_progress")
+                and operation._get_statement_line_candidates()
+            )
+
     @api.onchange("st_line_id")
     def onchange_st_line(self):
         if self.st_line_id:
@@ -132,73 +245,402 @@ class AccountMoveOperation(models.Model):
             )
 
     def action_start(self):
-        self.ensure_one()
-        if not self.partner_id:
+        self._start()
+
+    def _start(self, completed_steps=None):
+        """Start the draft operations.
+
+        :param completed_steps: optional dict mapping operation ids to
+            ``{step: vals}`` for the steps already executed outside of the
+            operation, the vals holding the document of the step. Those lines,
+            and the ones before them, are created done, and the step following
+            the last of them ready.
+        """
+        if self.filtered(lambda operation: not operation.partner_id):
             raise UserError(_("Please set a partner before starting operation."))
 
-        if self.state != "draft":
+        operations = self.filtered(lambda operation: operation.state == "draft")
+        if not operations:
             return
 
-        self._create_lines()
-        self.state = "in_progress"
+        operations._create_lines(completed_steps)
+        operations.write({"state": "in_progress"})
+        operations.filtered(
+            lambda operation: operation.step_done_count == operation.step_count
+        ).action_done()
 
-    def action_cancel(self):
-        self.ensure_one()
-        if self.state in ["done", "cancel"]:
+    def action_cancel(self, reverse_documents=False):
+        self.check_access("write")
+        operations = self._get_cancel_tree()
+        if not operations:
             return
 
-        self.state = "cancel"
-        self.line_ids.action_cancel()
+        if reverse_documents:
+            # Only the documents of the selected operations and of the sub
+            # operations below them, not the ones of the parents cancelled
+            # along, and with the rights of the user
+            self.filtered(
+                lambda operation: operation.state not in ["done", "cancel"]
+            ).sudo()._get_documents_tree().with_env(self.env)._reverse_documents()
 
-    def action_done(self):
-        self.ensure_one()
-        if self.state != "in_progress":
-            return
+        lines = operations.line_ids.filtered(
+            lambda line: line.state not in ["done", "cancel"]
+        )
+        for company, company_operations in operations.grouped("company_id").items():
+            company_lines = lines.filtered(
+                lambda line: line.operation_id in company_operations
+            )
+            company_lines.with_company(company).write({"state": "cancel"})
+            company_operations.with_company(company).write({"state": "cancel"})
 
-        self.state = "done"
+    def action_cancel_and_reverse(self):
+        return self.action_cancel(reverse_documents=True)
+
+    def action_done(self):
+        self.filtered(lambda operation: operation.state == "in_progress").write(
+            {"state": "done"}
+        )
 
     def action_next_step(self):
         self.ensure_one()
         if self.state != "in_progress":
             return
 
+        if not self._try_lock():
+            raise UserError(
+                _(
+                    "Operation %s is being processed by another user, please try again.",
+                    self.name,
+                )
+            )
+
         return self._get_next_action()
 
+    def action_reconcile_ready_steps(self):
+        lines = (
+            self._try_lock()
+            .filtered(lambda operation: operation.state == "in_progress")
+            .line_ids._reconcile_documents()
+        )
+        return self._get_steps_notification(
+            lines,
+            _("Reconciled steps: %s", len(lines)),
+            _("There is no step ready to be reconciled."),
+        )
+
+    def action_register_payments(self, group_payment=False):
+        lines = (
+            self._try_lock()
+            .filtered(lambda operation: operation.state == "in_progress")
+            .line_ids._register_payments(group_payment=group_payment)
+        )
+        return self._get_steps_notification(
+            lines,
+            _("Paid steps: %s", len(lines)),
+            _("There is no step ready to be paid."),
+        )
+
+    def action_run_auto_steps(self):
+        lines = self._run_auto_steps()
+        return self._get_steps_notification(
+            lines,
+            _("Executed steps: %s", ", ".join(lines.mapped("name"))),
+            _("There is no automatic step to execute."),
+        )
+
+    @api.model
+    def _get_steps_notification(self, lines, message, empty_message):
+        """Notify the user of the steps executed by a list action, and reload
+        the view."""
+        return {
+            "type": "ir.actions.client",
+            "tag": "display_notification",
+            "params": {
+                "message": message if lines else empty_message,
+                "type": "success" if lines else "warning",
+                "next": {"type": "ir.actions.client", "tag": "soft_reload"},
+            },
+        }
+
+    def action_start_in_background(self):
+        self.env["account.move.operation.job"]._enqueue(self, "start")
+
+    def action_run_auto_steps_in_background(self):
+        self.env["account.move.operation.job"]._enqueue(self, "run")
+
     def action_open_bank_statement_line(self):
         return self.st_line_id.action_open_recon_st_line()
 
-    def _create_lines(self):
-        line = self.env["account.move.operation.line"]
+    def _create_lines(self, completed_steps=None):
+        """Create the step lines of all the operations in a single batch."""
+        completed_steps = completed_steps or {}
         vals_list = []
-        for action in self.operation_type_id.action_ids:
-            vals_list.append(self._get_line_vals(action))
-        for vals in vals_list:
-            if line:
-                vals["orig_line_id"] = line.id
-            else:
-                vals["state"] = "ready"
-            line = line.create(vals)
+        for operation in self:
+            done_steps = completed_steps.get(operation.id, {})
+            last_done_step = max(done_steps, default=0)
+            for step, plan_step in enumerate(operation.operation_type_id._get_plan(), 1):
+                vals = operation._get_line_vals(plan_step)
+                vals["step"] = step
+                if step <= last_done_step:
+                    vals.update(done_steps.get(step, {}), state="done")
+                elif step == last_done_step + 1:
+                    vals["state"] = "ready"
+                vals_list.append(vals)
+        return self.env["account.move.operation.line"].create(vals_list)
 
-    def _get_line_vals(self, rule):
+    def _get_line_vals(self, plan_step):
         vals = {
-            "name": rule.name,
-            "action": rule.action,
+            "name": plan_step.name,
+            "action": plan_step.action,
             "state": "waiting",
-            "template_id": rule.template_id.id,
+            "template_id": plan_step.template_id,
+            "journal_id": plan_step.journal_id,
             "operation_id": self.id,
-            "date_last_document": rule.date_last_document,
-            "diff_partner": rule.diff_partner,
-            "action_id": rule.id,
-            "multicompany": rule.multicompany,
+            "date_last_document": plan_step.date_last_document,
+            "diff_partner": plan_step.diff_partner,
+            "action_id": plan_step.action_id,
+            "multicompany": plan_step.multicompany,
         }
         return vals
 
+    def _run_auto_steps(self):
+        """Advance the operations through all the consecutive steps that need no
+        user input, including the ones of the sub operations they create.
+
+        :return: the executed ``account.move.operation.line`` records
+        """
+        executed_lines = attempted_lines = self.env["account.move.operation.line"]
+        operations = self
+        while operations:
+            operations = operations._try_lock()
+            lines = (
+                operations.filtered(
+                    lambda operation: operation.state == "in_progress"
+                ).line_ids.filtered(
+                    lambda line: line.state == "ready" and line._is_auto_step()
+                )
+                - attempted_lines
+            )
+            move_lines = lines.filtered(lambda line: line.action == "move")
+            if move_lines.operation_id.company_id - self.env.companies:
+                move_lines = move_lines.sudo()
+            done_lines = move_lines._create_moves()
+            reconcile_lines = lines.filtered(lambda line: line.action == "reconcile")
+            if reconcile_lines.operation_id.company_id - self.env.companies:
+                reconcile_lines = reconcile_lines.sudo()
+            done_lines |= reconcile_lines._reconcile_documents()
+            step_lines = lines.filtered(
+                lambda line: line.action not in ("move", "reconcile")
+            )
+            for line in step_lines:
+                company = line.operation_id.company_id
+                if company not in self.env.companies:
+                    line = line.sudo()
+                line.with_company(company).with_context(
+                    operation_id=line.operation_id.id,
+                    operation_line_id=line.id,
+                )._run_step()
+            # Steps left ready, like the reconciliations of draft entries, are
+            # tried once and not reported
+            done_lines |= step_lines.filtered(lambda line: line.state != "ready")
+            attempted_lines |= lines
+            executed_lines |= done_lines.with_env(self.env)
+            operations = (
+                done_lines.operation_id
+                | done_lines.created_operation_id
+                | done_lines.operation_id.parent_line_id.operation_id
+            ).with_env(self.env)
+        return executed_lines
+
+    def _set_last_transition(self):
+        """Date the last state change of the steps of the operations."""
+        self.sudo().write({"date_last_transition": fields.Datetime.now()})
+
+    def _get_cancel_tree(self):
+        """Return every operation cancelled along with ``self``, as superuser.
+
+        Cancelling an operation cancels the sub operations created by its
+        pending steps, and a sub operation whose last step is still pending
+        cancels the operation it was created from. The whole tree is gathered
+        with a single recursive query.
+        """
+        if not self:
+            return self
+
+        self.env["account.move.operation.line"].flush_model(
+            ["operation_id", "state", "step", "created_operation_id"]
+        )
+        self.flush_model(["state", "parent_line_id"])
+        self.env.cr.execute(
+            SQL(
+                """
+                WITH RECURSIVE tree(id) AS (
+                    SELECT operation.id
+                      FROM account_move_operation operation
+                     WHERE operation.id = ANY(%s)
+                       AND operation.state NOT IN ('done', 'cancel')
+                    UNION
+                    SELECT linked.id
+                      FROM tree
+                      JOIN account_move_operation operation
+                        ON operation.id = tree.id
+                      JOIN account_move_operation_line line
+                        ON line.operation_id = operation.id
+                       AND line.state NOT IN ('done', 'cancel')
+                 LEFT JOIN account_move_operation_line parent_line
+                        ON parent_line.id = operation.parent_line_id
+                      JOIN account_move_operation linked
+                        ON linked.id = line.created_operation_id
+                        OR (
+                            linked.id = parent_line.operation_id
+                            AND NOT EXISTS (
+                                SELECT 1
+                                  FROM account_move_operation_line next_line
+                                 WHERE next_line.operation_id = line.operation_id
+                                   AND next_line.step > line.step
+                            )
+                        )
+                     WHERE linked.state NOT IN ('done', 'cancel')
+                )
+                SELECT id FROM tree
+                """,
+                self.ids,
+            )
+        )
+        return self.sudo().browse(operation_id for (operation_id,) in self.env.cr.fetchall())
+
+    def _get_documents_tree(self):
+        """Return the operations and all the sub operations created from them,
+        whatever their state."""
+        operations = self
+        sub_operations = self.line_ids.created_operation_id
+        while sub_operations - operations:
+            operations |= sub_operations
+            sub_operations = sub_operations.line_ids.created_operation_id
+        return operations
+
+    def _reverse_documents(self):
+        """Undo the documents generated by the steps of the operations.
+
+        Payments are cancelled first, which breaks their reconciliation with
+        the entries they paid. Posted entries are then reversed and draft ones
+        cancelled, with one call per company and journal.
+        """
+        lines = self.line_ids
+        payments = lines.payment_id.filtered(lambda payment: payment.state != "canceled")
+        moves = lines.move_id.filtered(lambda move: move.state != "cancel")
+        moves -= payments.move_id
+        today = fields.Date.context_today(self)
+
+        for (company, _journal), journal_payments in payments.grouped(
+            lambda payment: (payment.company_id, payment.journal_id)
+        ).items():
+            journal_payments = journal_payments.with_company(company)
+            journal_payments.action_draft()
+            journal_payments.action_cancel()
+
+        for (company, _journal), journal_moves in moves.grouped(
+            lambda move: (move.company_id, move.journal_id)
+        ).items():
+            journal_moves = journal_moves.with_company(company)
+            posted_moves = journal_moves.filtered(lambda move: move.state == "posted")
+            posted_moves._reverse_moves(
+                [
+                    {
+                        "ref": _("Reversal of: %s", move.name),
+                        "date": today,
+                        "invoice_date": move.is_invoice(include_receipts=True)
+                        and today,
+                    }
+                    for move in posted_moves
+                ],
+                cancel=True,
+            )
+            (journal_moves - posted_moves).button_cancel()
+
+    @api.model
+    def _get_match_window(self):
+        """Number of days around its date a statement line and an operation
+        can be apart to be suggested for each other."""
+        return timedelta(
+            days=int(
+                self.env["ir.config_parameter"]
+                .sudo()
+                .get_param("account_move_operation.st_match_days", 30)
+            )
+        )
+
+    def _get_statement_line_candidates(self, limit=5):
+        """Return the unreconciled statement lines of the partner most likely to
+        belong to this operation, the closest amount and date first.
+
+        The lookup goes through the partial index on partner and amount of the
+        unreconciled statement lines, and is ranked and limited in SQL.
+        """
+        self.ensure_one()
+        st_line_obj = self.env["account.bank.statement.line"]
+        if not self.partner_id:
+            return st_line_obj
+
+        window = self._get_match_window()
+        date = self.date or fields.Date.context_today(self)
+        linked_query = self._search(
+            [("st_line_id", "!=", False), ("state", "!=", "cancel")]
+        )
+        query = st_line_obj._search(
+            [
+                ("partner_id", "=", self.partner_id.id),
+                ("is_reconciled", "=", False),
+                ("company_id", "=", self.company_id.id),
+                ("currency_id", "=", self.currency_id.id),
+                ("date", ">=", date - window),
+                ("date", "<=", date + window),
+                ("id", "not in", linked_query.subselect("st_line_id")),
+            ],
+            limit=limit,
+        )
+        query.order = SQL(
+            "ABS(ABS(%s) - %s), ABS(%s - %s), %s",
+            st_line_obj._field_to_sql(st_line_obj._table, "amount", query),
+            abs(self.amount),
+            st_line_obj._field_to_sql(st_line_obj._table, "date", query),
+            date,
+            st_line_obj._field_to_sql(st_line_obj._table, "id", query),
+        )
+        return st_line_obj.browse(
+            st_line_id for (st_line_id,) in self.env.execute_query(query.select())
+        )
+
+    def _try_lock(self):
+        """Lock the operations until the end of the transaction, skipping the
+        ones another transaction is already advancing.
+
+        Operations are the unit of work: their steps run one after the other,
+        so holding the operation row is enough for the users advancing them
+        from the interface and the job crons to work on disjoint operations in
+        parallel without executing a step twice.
+
+        :return: the operations locked by the current transaction
+        """
+        if not self:
+            return self
+
+        self.env.cr.execute(
+            SQL(
+                "SELECT id FROM %s WHERE id = ANY(%s) FOR UPDATE SKIP LOCKED",
+                SQL.identifier(self._table),
+                self.ids,
+            )
+        )
+        locked = self.browse(operation_id for (operation_id,) in self.env.cr.fetchall())
+        locked.invalidate_recordset(["state"])
+        locked.line_ids.invalidate_recordset(["state"])
+        return locked
+
     def _get_next_action(self):
-        in_progress_line = self.line_ids.filtered(
-            lambda line: line.state == "in_progress"
-        )[:1]
-        if in_progress_line:
-            operation = in_progress_line.created_operation_id
+        current_line = self.current_line_id
+        if current_line.state == "in_progress":
+            operation = current_line.created_operation_id
             if operation and operation.company_id != self.env.company:
                 raise UserError(
                     _(
@@ -208,17 +650,16 @@ class AccountMoveOperation(models.Model):
                     )
                 )
 
-            return in_progress_line.action_view_document()
+            return current_line.action_view_document()
 
-        nxt_line = self.line_ids.filtered(lambda line: line.state == "ready")
-        if not nxt_line:
+        if current_line.state != "ready":
             raise UserError(_("There is no available action to execute."))
 
         context = self._context.copy()
         context.update(
             {
                 "operation_id": self.id,
-                "operation_line_id": nxt_line.id,
+                "operation_line_id": current_line.id,
             }
         )
-        return nxt_line.with_context(**context)._get_action()
+        return current_line.with_context(**context)._get_action()
@@ -48,6 +48,12 @@ class AccountMoveOperationActions(models.Model):
         comodel_name="account.move.template",
         string="Move Template",
     )
+    journal_id = fields.Many2one(
+        comodel_name="account.journal",
+        string="Payment Journal",
+        check_company=True,
+        domain="[('type', 'in', ('bank', 'cash'))]",
+    )
     operation_type_ids = fields.Many2many("account.move.operation.type")
     date_last_document = fields.Boolean(
         help="When creating an invoice, set the date to be the same of the previous document, "
@@ -67,6 +73,50 @@ class AccountMoveOperationActions(models.Model):
     auto = fields.Boolean(
         default=True, help="Help simplify process avoiding using intermediary wizards."
     )
+    match_move_type = fields.Selection(
+        selection="_get_match_move_type_selection",
+        compute="_compute_match_move_type",
+        store=True,
+        readonly=False,
+        help="Type of the existing journal entries that correspond to this action "
+        "when starting an operation from them.",
+    )
+    match_payment = fields.Boolean(
+        compute="_compute_match_payment",
+        store=True,
+        readonly=False,
+        help="Journal entries of payments correspond to this action when starting "
+        "an operation from them.",
+    )
+
+    @api.model
+    def _get_match_move_type_selection(self):
+        return self.env["account.move"]._fields["move_type"].selection
+
+    @api.depends("action", "template_id.move_type")
+    def _compute_match_move_type(self):
+        for action in self:
+            action.match_move_type = (
+                action.template_id.move_type if action.action == "move" else False
+            )
+
+    @api.depends("action")
+    def _compute_match_payment(self):
+        for action in self:
+            action.match_payment = action.action == "pay"
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        self.env.registry.clear_cache()
+        return super().create(vals_list)
+
+    def write(self, vals):
+        self.env.registry.clear_cache()
+        return super().write(vals)
+
+    def unlink(self):
+        self.env.registry.clear_cache()
+        return super().unlink()
 
     @api.onchange("operation_type_id", "company_id")
     def _onchange_operation_type(self):
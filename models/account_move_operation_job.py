@@ -0,0 +1,196 @@
+import logging
+import threading
+import traceback
+from datetime import timedelta
+
+from odoo import _, api, fields, models
+from odoo.tools import SQL
+
+_logger = logging.getLogger(__name__)
+
+
+class AccountMoveOperationJob(models.Model):
+    _name = "account.move.operation.job"
+    _description = "Account Operation Background Jobs"
+    _order = "date_next_attempt, id"
+
+    operation_id = fields.Many2one(
+        comodel_name="account.move.operation",
+        required=True,
+        readonly=True,
+        ondelete="cascade",
+        index=True,
+    )
+    company_id = fields.Many2one(related="operation_id.company_id", store=True)
+    job_type = fields.Selection(
+        selection=[
+            ("start", "Start"),
+            ("run", "Run Automatic Steps"),
+        ],
+        required=True,
+        readonly=True,
+    )
+    state = fields.Selection(
+        selection=[
+            ("pending", "Pending"),
+            ("done", "Done"),
+            ("failed", "Failed"),
+        ],
+        default="pending",
+        required=True,
+        readonly=True,
+        index=True,
+    )
+    attempts = fields.Integer(readonly=True)
+    date_next_attempt = fields.Datetime(
+        default=fields.Datetime.now,
+        readonly=True,
+        index=True,
+    )
+    error = fields.Text(readonly=True)
+
+    @api.model
+    def _enqueue(self, operations, job_type):
+        jobs = self.create(
+            [
+                {"operation_id": operation.id, "job_type": job_type}
+                for operation in operations
+            ]
+        )
+        self._get_crons()._trigger()
+        return jobs
+
+    @api.model
+    def _get_crons(self):
+        """Return the scheduled actions processing the jobs.
+
+        Odoo runs a scheduled action in one worker at a time, so processing the
+        queue in parallel takes several of them: duplicating the default one
+        adds a worker, and all of them are triggered when jobs are queued.
+        """
+        return (
+            self.env["ir.cron"]
+            .sudo()
+            .search(
+                [
+                    ("model_id.model", "=", self._name),
+                    ("code", "ilike", "_cron_process_jobs"),
+                ]
+            )
+        )
+
+    @api.model
+    def _cron_process_jobs(self):
+        """Process the pending jobs chunk by chunk.
+
+        Each chunk is committed on its own and the environment cache is cleared
+        afterwards, so the memory used by the cron does not grow with the
+        number of jobs; tests only skip the commit. Jobs are claimed with
+        ``SKIP LOCKED``, so the scheduled actions returned by ``_get_crons``
+        share the queue instead of waiting on each other. Operations are locked
+        the same way, as users advance them from the interface while the jobs
+        run.
+        """
+        get_param = self.env["ir.config_parameter"].sudo().get_param
+        chunk_size = int(get_param("account_move_operation.job_chunk_size", 100))
+        skipped_ids = []
+        while True:
+            jobs = self._claim(chunk_size, skipped_ids)
+            if not jobs:
+                return
+
+            locked_operations = jobs.operation_id._try_lock()
+            skipped_jobs = jobs.filtered(
+                lambda job: job.operation_id not in locked_operations
+            )
+            skipped_ids += skipped_jobs.ids
+            (jobs - skipped_jobs)._process()
+            if not getattr(threading.current_thread(), "testing", False):
+                self.env.cr.commit()
+            self.env.invalidate_all()
+
+    @api.model
+    def _claim(self, limit, excluded_ids=()):
+        """Lock up to ``limit`` due jobs that no other worker is processing."""
+        self.flush_model()
+        self.env.cr.execute(
+            SQL(
+                """
+                SELECT id
+                  FROM %s
+                 WHERE state = 'pending'
+                   AND date_next_attempt <= %s
+                   AND id != ALL(%s::int[])
+              ORDER BY date_next_attempt, id
+                 LIMIT %s
+                   FOR UPDATE SKIP LOCKED
+                """,
+                SQL.identifier(self._table),
+                fields.Datetime.now(),
+                list(excluded_ids),
+                limit,
+            )
+        )
+        return self.browse(job_id for (job_id,) in self.env.cr.fetchall())
+
+    def _process(self):
+        """Execute the jobs as a batch, and isolate the failing ones when the
+        whole batch can not be executed."""
+        try:
+            with self.env.cr.savepoint():
+                self._execute()
+        except Exception:
+            self.env.invalidate_all()
+            for job in self:
+                job._process_one()
+        else:
+            self.write({"state": "done", "error": False})
+
+    def _process_one(self):
+        self.ensure_one()
+        try:
+            with self.env.cr.savepoint():
+                self._execute()
+        except Exception as error:
+            self.env.invalidate_all()
+            _logger.warning(
+                "Job %s on operation %s failed",
+                self.job_type,
+                self.operation_id.name,
+                exc_info=True,
+            )
+            self._register_failure(error, traceback.format_exc())
+        else:
+            self.write({"state": "done", "error": False})
+
+    def _execute(self):
+        start_jobs = self.filtered(lambda job: job.job_type == "start")
+        start_jobs.operation_id.action_start()
+        run_jobs = self.filtered(lambda job: job.job_type == "run")
+        run_jobs.operation_id._run_auto_steps()
+
+    def _register_failure(self, error, error_traceback):
+        """Retry the job later with an exponential backoff, and flag it as failed
+        on the operation once it ran out of attempts. The traceback is kept on
+        the job, the operation only gets the error message."""
+        self.ensure_one()
+        get_param = self.env["ir.config_parameter"].sudo().get_param
+        max_attempts = int(get_param("account_move_operation.job_max_attempts", 5))
+        retry_delay = int(get_param("account_move_operation.job_retry_delay", 60))
+        attempts = self.attempts + 1
+        vals = {"attempts": attempts, "error": error_traceback}
+        if attempts >= max_attempts:
+            vals["state"] = "failed"
+            self.operation_id.message_post(
+                body=_(
+                    "Background job %(job)s failed after %(attempts)s attempts: %(error)s",
+                    job=dict(self._fields["job_type"].selection)[self.job_type],
+                    attempts=attempts,
+                    error=error,
+                )
+            )
+        else:
+            vals["date_next_attempt"] = fields.Datetime.now() + timedelta(
+                seconds=retry_delay * 2 ** (attempts - 1)
+            )
+        self.write(vals)
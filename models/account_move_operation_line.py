@@ -1,11 +1,24 @@
+from collections import defaultdict
+
 from odoo import _, api, fields, models
 from odoo.exceptions import UserError
+from odoo.fields import Command
 from odoo.tools.safe_eval import safe_eval
 
+DOCUMENT_FIELDS = ("move_id", "payment_id", "st_line_id")
+
 
 class AccountMoveOperationLine(models.Model):
     _name = "account.move.operation.line"
     _description = "Account Move Operation Lines"
+    _order = "operation_id, step, id"
+    _sql_constraints = [
+        (
+            "operation_step_uniq",
+            "unique(operation_id, step)",
+            "Two lines of the same operation can not share a step.",
+        ),
+    ]
 
     operation_id = fields.Many2one(
         comodel_name="account.move.operation",
@@ -26,19 +39,19 @@ class AccountMoveOperationLine(models.Model):
         copy=False,
         readonly=True,
     )
+    step = fields.Integer(
+        readonly=True,
+        help="Position of the line in the steps of its operation.",
+    )
     orig_line_id = fields.Many2one(
         comodel_name="account.move.operation.line",
-        readonly=True,
-        compute="_compute_orig_line",
-        inverse="_inverse_orig_line",
-        store=True,
+        compute="_compute_step_links",
+        compute_sudo=True,
     )
     dest_line_id = fields.Many2one(
         comodel_name="account.move.operation.line",
-        readonly=True,
-        compute="_compute_dest_line",
-        inverse="_inverse_dest_line",
-        store=True,
+        compute="_compute_step_links",
+        compute_sudo=True,
     )
     action = fields.Selection(
         selection=[
@@ -56,7 +69,7 @@ class AccountMoveOperationLine(models.Model):
         "account.move.template", "Move Template", readonly=True
     )
     journal_id = fields.Many2one("account.journal", "Journal", readonly=True)
-    move_id = fields.Many2one("account.move", readonly=True)
+    move_id = fields.Many2one("account.move", readonly=True, index="btree_not_null")
     payment_id = fields.Many2one("account.payment", readonly=True)
     st_line_id = fields.Many2one("account.bank.statement.line", readonly=True)
     created_operation_id = fields.Many2one("account.move.operation", readonly=True)
@@ -72,59 +85,90 @@ class AccountMoveOperationLine(models.Model):
     )
     multicompany = fields.Boolean(string="Is Multicompany")
 
-    @api.depends("orig_line_id.dest_line_id")
-    def _compute_orig_line(self):
-        for record in self.sudo():
-            record.orig_line_id = (
-                record.orig_line_id
-                if record.orig_line_id.dest_line_id == record
-                else False
-            )
-
-    def _inverse_orig_line(self):
-        for record in self.sudo():
-            record.orig_line_id.dest_line_id = record
-
-    @api.depends("dest_line_id.orig_line_id")
-    def _compute_dest_line(self):
-        for record in self.sudo():
-            record.dest_line_id = (
-                record.dest_line_id
-                if record.dest_line_id.orig_line_id == record
-                else False
-            )
-
-    def _inverse_dest_line(self):
-        for record in self.sudo():
-            record.dest_line_id.orig_line_id = record
+    @api.model_create_multi
+    def create(self, vals_list):
+        lines = super().create(vals_list)
+        lines.operation_id._set_last_transition()
+        lines.filtered(
+            lambda line: line.move_id or line.payment_id or line.st_line_id
+        )._update_last_document_date()
+        lines.filtered(lambda line: line.move_id or line.payment_id)._link_moves()
+        return lines
+
+    def write(self, vals):
+        changed_lines = (
+            self.filtered(lambda line: line.state != vals["state"])
+            if "state" in vals
+            else self.browse()
+        )
+        res = super().write(vals)
+        changed_lines.operation_id._set_last_transition()
+        if any(vals.get(fname) for fname in DOCUMENT_FIELDS):
+            self._update_last_document_date()
+        if vals.get("move_id") or vals.get("payment_id"):
+            self._link_moves()
+        return res
+
+    @api.depends(
+        "step",
+        "operation_id.line_ids.step",
+        "operation_id.parent_line_id.step",
+        "created_operation_id.line_ids.step",
+    )
+    def _compute_step_links(self):
+        """Resolve the previous and next step of every line.
+
+        Within an operation the order is given by ``step``. A sub operation is
+        spliced in place of the line that created it: its first line follows
+        the step before that line, and its last line leads back to it.
+        """
+        steps_by_operation = {}
+
+        def get_step(operation, step):
+            if operation not in steps_by_operation:
+                steps_by_operation[operation] = {
+                    line.step: line for line in operation.line_ids
+                }
+            return steps_by_operation[operation].get(step, self.browse())
 
-    def action_cancel(self):
-        lines = self.filtered(lambda line: line.state not in ["done", "cancel"])
-        lines.write({"state": "cancel"})
-        for line in lines:
+        for line in self:
+            parent_line = line.operation_id.parent_line_id
             if line.created_operation_id:
-                operation = line.created_operation_id.sudo().with_company(
-                    line.created_operation_id.company_id
-                )
-                operation.action_cancel()
-            if (
-                line.dest_line_id.operation_id
-                and line.operation_id
-                and line.dest_line_id.operation_id != line.operation_id
-            ):
-                dest_line = line.dest_line_id.sudo().with_company(
-                    line.dest_line_id.operation_id.company_id
-                )
-                dest_line.operation_id.action_cancel()
+                orig_line = line.created_operation_id.line_ids[-1:]
+            else:
+                orig_line = get_step(line.operation_id, line.step - 1)
+                if not orig_line and parent_line:
+                    orig_line = get_step(parent_line.operation_id, parent_line.step - 1)
+            line.orig_line_id = orig_line
+            line.dest_line_id = get_step(line.operation_id, line.step + 1) or parent_line
 
     def action_done(self):
-        self.state = "done"
-        if self.dest_line_id and self.dest_line_id.state == "waiting":
-            self.dest_line_id.state = "ready"
-        else:
-            self.operation_id.action_done()
-        if self.dest_line_id and self.dest_line_id.state == "in_progress":
-            self.sudo().dest_line_id.action_done()
+        """Complete the steps and move their chains forward.
+
+        All the transitions caused by the completion are worked out first,
+        following the chains into the steps waiting on sub operations, then
+        applied with one write per state.
+        """
+        self.check_access("write")
+        done_lines = self.browse().sudo()
+        ready_lines = self.browse().sudo()
+        done_operations = self.env["account.move.operation"].sudo()
+        lines = self.sudo().filtered(lambda line: line.state not in ["done", "cancel"])
+        while lines:
+            done_lines |= lines
+            dest_lines = lines.dest_line_id
+            waiting_lines = dest_lines.filtered(lambda line: line.state == "waiting")
+            ready_lines |= waiting_lines
+            done_operations |= lines.filtered(
+                lambda line: line.dest_line_id.operation_id != line.operation_id
+            ).operation_id
+            lines = (
+                dest_lines.filtered(lambda line: line.state == "in_progress")
+                - done_lines
+            )
+        done_lines.write({"state": "done"})
+        (ready_lines - done_lines).write({"state": "ready"})
+        done_operations.action_done()
 
     def action_in_progress(self):
         self.write({"state": "in_progress"})
@@ -209,14 +253,43 @@ class AccountMoveOperationLine(models.Model):
 
     def _get_action(self):
         self.ensure_one()
-        action = self._get_action_move()
+        action = self._get_action_diff_partner()
         if action:
             return action
 
+        return self._run_step()
+
+    def _run_step(self):
+        if self.state != "ready":
+            return False
+
         method_name = "_get_action_%s" % self.action
         get_action_method = getattr(self, method_name)
         return get_action_method()
 
+    def _is_auto_step(self):
+        """Whether the line can be executed without asking anything to the user."""
+        self.ensure_one()
+        if self.action == "info":
+            return True
+        plan_step = self._get_plan_step()
+        auto = plan_step.auto if plan_step else self.action_id.auto
+        if self.action in ("move", "operation") and auto:
+            return not self.diff_partner or bool(self.operation_id.diff_partner_id)
+        if self.action == "reconcile" and auto:
+            return bool(self.operation_id.st_line_id)
+        return False
+
+    def _get_plan_step(self):
+        """Return the step of the compiled plan the line was created from, or
+        None when its action is no longer part of the plan."""
+        self.ensure_one()
+        plan = self.operation_id.operation_type_id._get_plan()
+        return next(
+            (plan_step for plan_step in plan if plan_step.action_id == self.action_id.id),
+            None,
+        )
+
     def _get_action_diff_partner(self):
         if self.diff_partner and not self._context.get("default_partner_id"):
             action = self.env["ir.actions.actions"]._for_xml_id(
@@ -232,45 +305,109 @@ class AccountMoveOperationLine(models.Model):
 
     def _get_action_move(self):
         self.ensure_one()
-        ctx = self._context.copy()
+        self._create_moves()
+        return True
 
+    def _create_moves(self):
+        """Create the documents of the ready ``move`` steps and complete them.
+
+        Journal entries are built in memory from the templates and created
+        with one ``create`` per company, instead of going through an
+        ``account.move.template.run`` record for every step.
+
+        :return: the completed lines
+        """
+        lines = self.filtered(lambda line: line.state == "ready")
+        if not lines:
+            return lines
+
+        for company, company_lines in lines.grouped(
+            lambda line: line.operation_id.company_id
+        ).items():
+            company_lines = company_lines.with_company(company)
+            amounts_by_line = {}
+            for template, template_lines in company_lines.grouped("template_id").items():
+                amounts_list = template._compute_lines_batch(
+                    [line._get_template_sets() for line in template_lines],
+                    company.currency_id,
+                )
+                amounts_by_line.update(zip(template_lines, amounts_list))
+            moves = self.env["account.move"].with_company(company).create(
+                [line._prepare_move_vals(amounts_by_line[line]) for line in company_lines]
+            )
+            to_post = self.env["account.move"]
+            for line, move in zip(company_lines, moves):
+                # The entries already carry their operation, the date of the
+                # operations is kept up to date once for the whole batch
+                super(AccountMoveOperationLine, line).write({"move_id": move.id})
+                if line.template_id.post:
+                    to_post |= move
+            to_post.action_post()
+            company_lines._update_last_document_date()
+        lines.action_done()
+        return lines
+
+    def _get_template_run_context(self):
+        ctx = self._context.copy()
         if self.action_id.auto and self.operation_id.amount:
             ctx.update({"amount": self.operation_id.amount})
+        return ctx
 
-        wizard_vals = {
+    def _get_template_run_vals(self):
+        vals = {
             "template_id": self.template_id.id,
             "partner_id": self.operation_id.partner_id.id,
-            "date": fields.Date.context_today(self),
+            "date": self.date_last_document
+            and self.operation_id.last_document_date
+            or fields.Date.context_today(self),
             "ref": self.operation_id.reference or self.template_id.ref,
             "amount": self.operation_id.amount,
         }
 
         if self.diff_partner and self.operation_id.diff_partner_id:
-            wizard_vals["diff_partner_id"] = self.operation_id.diff_partner_id.id
+            vals["diff_partner_id"] = self.operation_id.diff_partner_id.id
         if self.multicompany and self.operation_id.multicompany_id:
-            wizard_vals["multicompany_id"] = self.operation_id.multicompany_id.id
+            vals["multicompany_id"] = self.operation_id.multicompany_id.id
+        return vals
+
+    def _get_template_sets(self):
+        """Amounts of the input lines of the template, by sequence."""
+        return {
+            template_line.sequence: self.operation_id.amount
+            for template_line in self.template_id.line_ids
+            if template_line.type == "input"
+        }
+
+    def _prepare_move_vals(self, amounts=None):
+        """Return the values of the journal entry the template run wizard
+        would create for this step, without creating the wizard.
 
+        :param amounts: rounded amounts of the template lines by sequence, as
+            returned by ``account.move.template._compute_lines_batch``
+        """
+        self.ensure_one()
         wizard = (
-            self.env["account.move.template.run"].with_context(ctx).create(wizard_vals)
+            self.env["account.move.template.run"]
+            .with_context(self._get_template_run_context())
+            .new(self._get_template_run_vals())
         )
+        currency = wizard.company_id.currency_id
+        if amounts is None:
+            amounts = self.template_id._compute_lines_batch(
+                [self._get_template_sets()], currency
+            )[0]
+        # The run lines carry what load_lines fills in per line, like the
+        # partner fallback, the same way the wizard uses them
         wizard.load_lines()
-        result = wizard.create_move()
-
-        if result._name == "account.move":
-            self.move_id = result.id
-        elif result._name == "account.payment":
-            self.payment_id = result.id
-
-        self.state = "done"
-
-        if self.dest_line_id and self.dest_line_id.state == "waiting":
-            self.dest_line_id.state = "ready"
-        elif self.dest_line_id and self.dest_line_id.state == "in_progress":
-            self.sudo().dest_line_id.action_done()
-        elif not self.dest_line_id:
-            self.operation_id.action_done()
-
-        return True
+        move_vals = wizard._prepare_move()
+        move_vals["operation_id"] = self.operation_id.id
+        for run_line in wizard.line_ids:
+            amount = amounts[run_line.sequence]
+            if not currency.is_zero(amount):
+                move_vals["line_ids"].append(
+                    Command.create(wizard._prepare_move_line(run_line, amount))
+                )
+        return move_vals
 
     def _get_action_operation(self):
         if self.action_id.auto:
@@ -293,17 +430,14 @@ class AccountMoveOperationLine(models.Model):
 
     def _get_action_pay(self):
         if self.action_id.auto:
-            move = self.orig_line_id._get_latest_move()
-            if not move:
+            if not self.orig_line_id._get_latest_move():
                 raise UserError(_("Missing invoice to pay"))
 
-            wiz = self.env["account.move.operation.payment"].create(
-                {
-                    "move_id": move.id,
-                    "line_id": self.id,
-                }
-            )
-            return wiz.action_open_register_payment()
+            if not self._register_payments():
+                raise UserError(
+                    _("Nothing to pay: the invoice must be posted and not paid yet.")
+                )
+            return True
 
         action = self.env["ir.actions.actions"]._for_xml_id(
             "account_move_operation.account_move_operation_payment_action"
@@ -313,19 +447,19 @@ class AccountMoveOperationLine(models.Model):
 
     def _get_action_reconcile(self):
         if self.action_id.auto:
-            move = self._get_latest_move()
-            if not move:
+            if not self._get_latest_move():
                 raise UserError(_("Missing invoice to reconcile"))
-
-            wiz = self.env["account.move.operation.reconcile"].create(
-                {
-                    "partner_id": self.operation_id.partner_id.id,
-                    "move_id": move.id,
-                    "line_id": self.id,
-                    "st_line_id": self.operation_id.st_line_id.id,
-                }
-            )
-            return wiz.action_open_reconcile()
+            if not self.operation_id.st_line_id:
+                raise UserError(_("Missing bank statement line to reconcile"))
+
+            if not self._reconcile_documents():
+                raise UserError(
+                    _(
+                        "Nothing to reconcile: the invoice must be posted and open, "
+                        "and the bank statement line not reconciled yet."
+                    )
+                )
+            return True
 
         action = self.env["ir.actions.actions"]._for_xml_id(
             "account_move_operation.account_move_operation_reconcile_action"
@@ -333,6 +467,138 @@ class AccountMoveOperationLine(models.Model):
         action = self._update_action_context(action)
         return action
 
+    def _reconcile_documents(self):
+        """Reconcile the latest journal entry of the ready ``reconcile`` steps
+        with the statement line of their operation, and complete them.
+
+        The entries of all the lines are resolved with one walk back through
+        the chains. The reconciliation goes through the bank reconciliation
+        widget, which replaces the suspense line of the statement line with the
+        receivable or payable lines, so it runs once per statement line with
+        the entries of all its operations.
+
+        Steps whose entry is not posted, or whose statement line is already
+        reconciled, are left ready.
+
+        :return: the completed lines
+        """
+        lines = self.filtered(
+            lambda line: line.state == "ready" and line.action == "reconcile"
+        )
+        moves_by_line = lines._get_latest_moves()
+        lines_by_st_line = defaultdict(lambda: self.browse())
+        for line in lines:
+            st_line = line.operation_id.st_line_id
+            move = moves_by_line[line.id]
+            if (
+                st_line
+                and not st_line.is_reconciled
+                and move
+                and move.state == "posted"
+            ):
+                lines_by_st_line[st_line] |= line
+
+        done_lines = self.browse()
+        for st_line, st_lines_lines in lines_by_st_line.items():
+            amls_by_line = {
+                line: moves_by_line[line.id].line_ids.filtered(
+                    lambda aml: aml.account_id.account_type
+                    in ("asset_receivable", "liability_payable")
+                    and aml.parent_state == "posted"
+                    and not aml.reconciled
+                )
+                for line in st_lines_lines
+            }
+            st_lines_lines = st_lines_lines.filtered(lambda line: amls_by_line[line])
+            if not st_lines_lines:
+                continue
+
+            wizard = (
+                self.env["bank.rec.widget"]
+                .with_company(st_line.company_id)
+                .with_context(default_st_line_id=st_line.id)
+                .new({})
+            )
+            wizard._action_add_new_amls(
+                self.env["account.move.line"].concat(
+                    *(amls_by_line[line] for line in st_lines_lines)
+                )
+            )
+            wizard._action_validate()
+            st_lines_lines.write({"st_line_id": st_line.id})
+            done_lines |= st_lines_lines
+        done_lines.action_done()
+        return done_lines
+
+    def _register_payments(self, group_payment=False):
+        """Pay the invoice of the ready ``pay`` steps and complete them.
+
+        The invoices are resolved with one walk back through the chains, and
+        paid with one ``account.payment.register`` per company, journal,
+        partner and currency.
+
+        :param group_payment: create a single payment per group instead of one
+            per invoice
+        :return: the completed lines
+        """
+        lines = self.filtered(
+            lambda line: line.state == "ready" and line.action == "pay"
+        )
+        moves_by_orig_line = lines.orig_line_id._get_latest_moves()
+        moves_by_line = {
+            line: moves_by_orig_line.get(line.orig_line_id.id) for line in lines
+        }
+        lines = lines.filtered(
+            lambda line: moves_by_line[line]
+            and moves_by_line[line].state == "posted"
+            and moves_by_line[line].payment_state in ("not_paid", "partial")
+        )
+
+        done_lines = self.browse()
+        for (company, journal, partner, currency), group_lines in lines.grouped(
+            lambda line: (
+                moves_by_line[line].company_id,
+                line.journal_id,
+                moves_by_line[line].commercial_partner_id,
+                moves_by_line[line].currency_id,
+            )
+        ).items():
+            moves = self.env["account.move"].concat(
+                *(moves_by_line[line] for line in group_lines)
+            )
+            register_vals = {"group_payment": group_payment}
+            if journal:
+                register_vals["journal_id"] = journal.id
+            payments = (
+                self.env["account.payment.register"]
+                .with_company(company)
+                .with_context(active_model="account.move", active_ids=moves.ids)
+                .create(register_vals)
+                ._create_payments()
+            )
+            payment_by_move = {
+                move: payment
+                for payment in payments
+                for move in (
+                    payment.reconciled_invoice_ids | payment.reconciled_bill_ids
+                )
+            }
+            unpaid_moves = moves - self.env["account.move"].concat(*payment_by_move)
+            if unpaid_moves:
+                raise UserError(
+                    _(
+                        "No payment could be linked to the invoices: %s",
+                        ", ".join(unpaid_moves.mapped("name")),
+                    )
+                )
+            for payment, payment_lines in group_lines.grouped(
+                lambda line: payment_by_move[moves_by_line[line]]
+            ).items():
+                payment_lines.write({"payment_id": payment.id})
+            done_lines |= group_lines
+        done_lines.action_done()
+        return done_lines
+
     def _update_action_context(self, action):
         context = self._context.copy()
         if "context" in action and isinstance(action["context"], str):
@@ -348,29 +614,97 @@ class AccountMoveOperationLine(models.Model):
         )
         return action
 
-    def _get_latest_move(self):
-        if self.move_id:
-            return self.move_id
+    def _walk_back(self, get_value):
+        """Follow the previous steps of every line until ``get_value`` returns
+        something for one of them.
+
+        The chains of all the lines are walked together, one hop at a time and
+        as superuser, so each hop costs one batched read however many lines and
+        companies are involved, and long chains do not recurse.
+
+        :return: dict mapping the id of each line to the value found, or False
+        """
+        result = dict.fromkeys(self.ids, False)
+        current = {line_id: line_id for line_id in self.ids}
+        lines = self.sudo()
+        while current:
+            frontier = {line.id: line for line in lines.browse(set(current.values()))}
+            next_current = {}
+            for origin_id, line_id in current.items():
+                line = frontier[line_id]
+                value = get_value(line)
+                if value:
+                    result[origin_id] = value
+                elif line.orig_line_id:
+                    next_current[origin_id] = line.orig_line_id.id
+            current = next_current
+        return result
+
+    def _get_latest_moves(self):
+        """Return the latest journal entry of the chain of each line, by line id."""
+        moves = self._walk_back(lambda line: line.move_id)
+        return {
+            line_id: move and move.with_env(self.env) for line_id, move in moves.items()
+        }
 
-        if self.orig_line_id:
-            return self.orig_line_id._get_latest_move()
+    def _get_latest_document_dates(self):
+        """Return the date of the latest document of the chain of each line, by
+        line id."""
 
-        return False
+        def get_document_date(line):
+            doc = line.st_line_id or line.move_id or line.payment_id
+            return doc and (doc.date or doc.invoice_date)
 
-    def _get_latest_document_date(self):
-        doc = self.st_line_id or self.move_id or self.payment_id
-        if doc:
-            return doc.date or doc.invoice_date
-
-        orig = self.orig_line_id
-        if orig:
-            if self.operation_id.company_id != orig.operation_id.company_id:
-                return (
-                    orig.sudo()
-                    .with_company(orig.operation_id.company_id)
-                    ._get_latest_document_date()
-                )
+        return self._walk_back(get_document_date)
 
-            return orig._get_latest_document_date()
+    def _link_moves(self):
+        """Set the operation on the journal entries attached to the steps,
+        directly or through their payment, unless an earlier operation already
+        owns them."""
+        for operation, lines in self.sudo().grouped("operation_id").items():
+            moves = lines.move_id | lines.payment_id.move_id
+            moves.filtered(lambda move: not move.operation_id).write(
+                {"operation_id": operation.id}
+            )
 
-        return False
+    def _update_last_document_date(self):
+        """Keep the date of the latest document of each operation up to date.
+
+        The date goes up to the parent operations too, so the steps following
+        a sub operation read it from their own operation. When several steps
+        of an operation get a document at once, the latest step wins: the
+        steps of a sub operation count as the step that created it.
+        """
+        latest_by_operation = {}
+        for line in self.sudo():
+            doc = line.st_line_id or line.move_id or line.payment_id
+            date = doc.date or doc.invoice_date
+            position = (line.step,)
+            operation = line.operation_id
+            while operation:
+                if position > latest_by_operation.get(operation, ((),))[0]:
+                    latest_by_operation[operation] = (position, date)
+                position = (operation.parent_line_id.step, *position)
+                operation = operation.parent_line_id.operation_id
+
+        operations_by_date = defaultdict(
+            lambda: self.env["account.move.operation"].sudo()
+        )
+        for operation, (_position, date) in latest_by_operation.items():
+            operations_by_date[date] |= operation
+        for date, operations in operations_by_date.items():
+            operations.write({"last_document_date": date})
+
+    def _get_latest_move(self):
+        if not self:
+            return False
+
+        self.ensure_one()
+        return self._get_latest_moves()[self.id]
+
+    def _get_latest_document_date(self):
+        if not self:
+            return False
+
+        self.ensure_one()
+        return self._get_latest_document_dates()[self.id]
@@ -1,4 +1,25 @@
-from odoo import fields, models
+import re
+from collections import namedtuple
+
+from odoo import _, api, fields, models, tools
+from odoo.exceptions import ValidationError
+
+PlanStep = namedtuple(
+    "PlanStep",
+    [
+        "action_id",
+        "name",
+        "action",
+        "template_id",
+        "journal_id",
+        "date_last_document",
+        "diff_partner",
+        "multicompany",
+        "auto",
+        "match_move_type",
+        "match_payment",
+    ],
+)
 
 
 class AccountMoveType(models.Model):
@@ -34,3 +55,101 @@ class AccountMoveType(models.Model):
         help="This indicates an operation started on a partner different than the one on the last operation.",
     )
     multicompany = fields.Boolean()
+    st_partner_ids = fields.Many2many(
+        "res.partner",
+        string="Statement Partners",
+        help="Only create operations of this type from statement lines of these partners.",
+    )
+    st_journal_ids = fields.Many2many(
+        "account.journal",
+        string="Statement Journals",
+        domain="[('type', 'in', ('bank', 'cash'))]",
+        help="Only create operations of this type from statement lines of these journals.",
+    )
+    st_amount_min = fields.Float(
+        string="Minimum Amount",
+        help="Minimum absolute amount of the statement lines, zero means no minimum.",
+    )
+    st_amount_max = fields.Float(
+        string="Maximum Amount",
+        help="Maximum absolute amount of the statement lines, zero means no maximum.",
+    )
+    st_label_pattern = fields.Char(
+        string="Label Pattern",
+        help="Regular expression searched in the label of the statement lines, "
+        "ignoring the case.",
+    )
+
+    @api.constrains("st_label_pattern")
+    def _check_st_label_pattern(self):
+        for operation_type in self.filtered("st_label_pattern"):
+            try:
+                re.compile(operation_type.st_label_pattern)
+            except re.error as error:
+                raise ValidationError(
+                    _(
+                        "Invalid label pattern on %(type)s: %(error)s",
+                        type=operation_type.name,
+                        error=error,
+                    )
+                ) from error
+
+    def _get_statement_line_matcher(self):
+        """Return a function telling whether a statement line follows the rules
+        of this type. The rules are read once, so the function can be called on
+        many lines cheaply."""
+        self.ensure_one()
+        partner_ids = set(self.st_partner_ids.ids)
+        journal_ids = set(self.st_journal_ids.ids)
+        amount_min = self.st_amount_min
+        amount_max = self.st_amount_max
+        label_pattern = self.st_label_pattern and re.compile(
+            self.st_label_pattern, re.IGNORECASE
+        )
+        company = self.company_id
+
+        def match(st_line):
+            amount = abs(st_line.amount)
+            return (
+                (not company or st_line.company_id == company)
+                and (not partner_ids or st_line.partner_id.id in partner_ids)
+                and (not journal_ids or st_line.journal_id.id in journal_ids)
+                and (not amount_min or amount >= amount_min)
+                and (not amount_max or amount <= amount_max)
+                and (
+                    not label_pattern
+                    or bool(label_pattern.search(st_line.payment_ref or ""))
+                )
+            )
+
+        return match
+
+    def _get_plan(self):
+        """Return the steps followed by the operations of this type.
+
+        The plan is a tuple of immutable ``PlanStep`` holding plain values, it
+        is compiled once and cached until an action is modified.
+        """
+        self.ensure_one()
+        return self._compile_plan(self.id)
+
+    @api.model
+    @tools.ormcache("type_id", "self.env.lang")
+    def _compile_plan(self, type_id):
+        operation_type = self.sudo().with_context(active_test=True).browse(type_id)
+        return tuple(
+            PlanStep(
+                action_id=action.id,
+                name=action.name,
+                action=action.action,
+                template_id=action.template_id.id,
+                journal_id=action.journal_id.id,
+                date_last_document=action.date_last_document,
+                diff_partner=action.diff_partner,
+                multicompany=action.multicompany,
+                auto=action.auto,
+                match_move_type=action.match_move_type,
+                match_payment=action.match_payment,
+            )
+            for action in operation_type.action_ids
+        )
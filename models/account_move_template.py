@@ -0,0 +1,84 @@
+import logging
+
+from odoo import models
+from odoo.tools.safe_eval import safe_eval
+
+_logger = logging.getLogger(__name__)
+
+try:
+    import numpy
+except ImportError:
+    _logger.debug("numpy is not installed, template lines are computed one set at a time")
+    numpy = None
+
+
+class AccountMoveTemplate(models.Model):
+    _inherit = "account.move.template"
+
+    def write(self, vals):
+        if "move_type" in vals:
+            # The move type is part of the compiled plans of the operation types
+            self.env.registry.clear_cache()
+        return super().write(vals)
+
+    def _compute_lines_batch(self, sets_list, currency):
+        """Compute the amounts of the template for many sets of input amounts.
+
+        Every formula of the computed lines is evaluated once for the whole
+        batch, over arrays holding one value per set. Formulas that can not be
+        evaluated column-wise, like the ones using conditions, are computed one
+        set at a time through ``compute_lines``.
+
+        :param sets_list: list of ``{sequence: amount}`` of the input lines
+        :param currency: currency the amounts are rounded with
+        :return: list of ``{sequence: amount}`` of all the lines, rounded
+        """
+        self.ensure_one()
+        if numpy is None or len(sets_list) < 2:
+            return self._compute_lines_one_by_one(sets_list, currency)
+
+        columns = {
+            sequence: numpy.array([sets.get(sequence, 0.0) for sets in sets_list])
+            for sequence in set().union(*sets_list)
+        }
+        try:
+            for line in self.line_ids.filtered(lambda x: x.type == "computed"):
+                value = safe_eval(
+                    line.python_code,
+                    {"L%d" % sequence: column for sequence, column in columns.items()},
+                )
+                columns[line.sequence] = numpy.broadcast_to(
+                    numpy.asarray(value, dtype=float), (len(sets_list),)
+                )
+        except Exception:
+            _logger.debug(
+                "Template %s can not be computed column-wise", self.name, exc_info=True
+            )
+            return self._compute_lines_one_by_one(sets_list, currency)
+
+        columns = {
+            sequence: self._round_column(column, currency)
+            for sequence, column in columns.items()
+        }
+        return [
+            {sequence: float(column[index]) for sequence, column in columns.items()}
+            for index in range(len(sets_list))
+        ]
+
+    def _compute_lines_one_by_one(self, sets_list, currency):
+        return [
+            {
+                sequence: currency.round(amount)
+                for sequence, amount in self.compute_lines(dict(sets)).items()
+            }
+            for sets in sets_list
+        ]
+
+    def _round_column(self, column, currency):
+        """Round an array of amounts the way ``float_round`` rounds each of
+        them: half-up, with the same epsilon correction."""
+        normalized = column / currency.rounding
+        with numpy.errstate(divide="ignore"):
+            epsilon = numpy.exp2(numpy.log2(numpy.abs(normalized)) - 52)
+        normalized = normalized + numpy.sign(normalized) * epsilon
+        return numpy.round(normalized) * currency.rounding
@@ -0,0 +1,81 @@
+from odoo import api, fields, models
+from odoo.tools import SQL
+
+
+class IrSequence(models.Model):
+    _inherit = "ir.sequence"
+
+    @api.model
+    def _next_block_by_code(self, sequence_code, count, sequence_date=None):
+        """Same as ``next_by_code`` but reserving ``count`` numbers at once."""
+        self.browse().check_access("read")
+        sequence = self.search(
+            [
+                ("code", "=", sequence_code),
+                ("company_id", "in", [self.env.company.id, False]),
+            ],
+            order="company_id",
+            limit=1,
+        )
+        if not sequence:
+            return [False] * count
+        return sequence._next_block(count, sequence_date=sequence_date)
+
+    def _next_block(self, count, sequence_date=None):
+        """Reserve ``count`` consecutive numbers with a single query.
+
+        Standard sequences draw the numbers from their PostgreSQL sequence,
+        which never locks the ``ir.sequence`` row. No gap sequences keep their
+        guarantee and lock the row once for the whole block instead of once
+        per number.
+        """
+        self.ensure_one()
+        sequence = self
+        number_sequence = self
+        sequence_name = "ir_sequence_%03d" % self.id
+        if self.use_date_range:
+            date = sequence_date or self._context.get(
+                "ir_sequence_date", fields.Date.today()
+            )
+            date_range = self.env["ir.sequence.date_range"].search(
+                [
+                    ("sequence_id", "=", self.id),
+                    ("date_from", "<=", date),
+                    ("date_to", ">=", date),
+                ],
+                limit=1,
+            )
+            if not date_range:
+                date_range = self._create_date_range_seq(date)
+            sequence = self.with_context(ir_sequence_date_range=date_range.date_from)
+            number_sequence = date_range
+            sequence_name = "ir_sequence_%03d_%03d" % (self.id, date_range.id)
+
+        if self.implementation == "standard":
+            self.env.cr.execute(
+                SQL(
+                    "SELECT nextval(%s) FROM generate_series(1, %s)",
+                    sequence_name,
+                    count,
+                )
+            )
+            numbers = [number for (number,) in self.env.cr.fetchall()]
+        else:
+            increment = self.number_increment
+            self.env.cr.execute(
+                SQL(
+                    """
+                    UPDATE %s
+                       SET number_next = number_next + %s
+                     WHERE id = %s
+                 RETURNING number_next
+                    """,
+                    SQL.identifier(number_sequence._table),
+                    count * increment,
+                    number_sequence.id,
+                )
+            )
+            number_next = self.env.cr.fetchone()[0]
+            number_sequence.invalidate_recordset(["number_next"])
+            numbers = range(number_next - count * increment, number_next, increment)
+        return [sequence.get_next_char(number) for number in numbers]
@@ -1,15 +1,70 @@
+import {useEffect} from "@odoo/owl";
+import {_t} from "@web/core/l10n/translation";
+import {useService} from "@web/core/utils/hooks";
 import {patch} from "@web/core/utils/patch";
+import {SelectCreateDialog} from "@web/views/view_dialogs/select_create_dialog";
 
 import {BankRecKanbanController} from "@account_accountant/components/bank_reconciliation/kanban";
 
 patch(BankRecKanbanController.prototype, {
+    setup() {
+        super.setup(...arguments);
+        this.dialogService = useService("dialog");
+        // Operation suggestions by statement line id, loaded for the whole page
+        this.operationSuggestions = new Map();
+        useEffect(
+            (stLineIds) => {
+                this.loadOperationSuggestions(stLineIds ? stLineIds.split(",").map(Number) : []);
+            },
+            () => [this.model.root.records.map((record) => record.resId).join(",")]
+        );
+    },
+
+    async loadOperationSuggestions(stLineIds) {
+        const missingIds = stLineIds.filter((stLineId) => !this.operationSuggestions.has(stLineId));
+        if (!missingIds.length) {
+            return;
+        }
+        const suggestions = await this.orm.call("account.bank.statement.line", "get_operation_suggestions", [
+            missingIds,
+        ]);
+        for (const [stLineId, candidates] of Object.entries(suggestions)) {
+            this.operationSuggestions.set(Number(stLineId), candidates);
+        }
+    },
+
     async actionOperation() {
         await this.execProtectedBankRecAction(async () => {
-            await this.withNewState(async (newState) => {
-                const {return_todo_command: actionData} = await this.onchange(newState, "account_operation");
-                if (actionData) {
-                    this.action.doAction(actionData);
-                }
+            const stLineId = this.state.bankRecStLineId;
+            if (!this.operationSuggestions.has(stLineId)) {
+                await this.loadOperationSuggestions([stLineId]);
+            }
+            const candidates = this.operationSuggestions.get(stLineId) || [];
+            // The line may get linked to an operation, suggest again next time
+            this.operationSuggestions.delete(stLineId);
+            const newOperationAction = {
+                type: "ir.actions.act_window",
+                res_model: "account.move.operation",
+                views: [[false, "form"]],
+                context: {default_st_line_id: stLineId},
+            };
+            if (!candidates.length) {
+                await this.action.doAction(newOperationAction);
+                return;
+            }
+            this.dialogService.add(SelectCreateDialog, {
+                title: _t("Suggested Operations"),
+                resModel: "account.move.operation",
+                domain: [["id", "in", candidates.map((candidate) => candidate.id)]],
+                multiSelect: false,
+                onSelected: async ([operationId]) => {
+                    const action = await this.orm.call("account.bank.statement.line", "action_link_operation", [
+                        [stLineId],
+                        operationId,
+                    ]);
+                    await this.action.doAction(action);
+                },
+                onCreateEdit: () => this.action.doAction(newOperationAction),
             });
         });
     },
@@ -1,9 +1,12 @@
 # Copyright 2018-2019 ForgeFlow, S.L.
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
 import logging
+from contextlib import closing
 
-from odoo.exceptions import UserError
-from odoo.tests import Form, tagged
+from odoo import fields, sql_db
+from odoo.exceptions import AccessError, UserError, ValidationError
+from odoo.fields import Command
+from odoo.tests import Form, new_test_user, tagged
 
 from odoo.addons.account_accountant.tests.test_bank_rec_widget_common import (
     TestBankRecWidgetCommon,
@@ -800,3 +803,1004 @@ class TestAccountMoveTemplate(TestBankRecWidgetCommon):
             ],
         )
         self.assertEqual(operation.state, "done")
+
+    def test_07_start_operations_batch(self):
+        def start_operations(count):
+            operations = self.operation_obj.with_context(tracking_disable=True).create(
+                [
+                    {
+                        "operation_type_id": self.operation_type.id,
+                        "partner_id": self.partner.id,
+                        "currency_id": self.company.currency_id.id,
+                    }
+                    for _i in range(count)
+                ]
+            )
+            self.env.flush_all()
+            self.env.invalidate_all()
+            queries_before = self.cr.sql_log_count
+            operations.action_start()
+            self.env.flush_all()
+            return operations, self.cr.sql_log_count - queries_before
+
+        operation, single_count = start_operations(1)
+        operations, batch_count = start_operations(20)
+        self.assertLess(batch_count, single_count * 3)
+        self.assertEqual(set(operations.mapped("state")), {"in_progress"})
+        for operation in operation | operations:
+            lines = operation.line_ids
+            self.assertRecordValues(
+                lines,
+                [
+                    {"state": "ready", "orig_line_id": False, "dest_line_id": lines[1].id},
+                    {"state": "waiting", "orig_line_id": lines[0].id, "dest_line_id": lines[2].id},
+                    {"state": "waiting", "orig_line_id": lines[1].id, "dest_line_id": lines[3].id},
+                    {"state": "waiting", "orig_line_id": lines[2].id, "dest_line_id": False},
+                ],
+            )
+
+    def test_08_sub_operation_step_links(self):
+        operation = self.operation_obj.create(
+            {
+                "operation_type_id": self.operation_type_2.id,
+                "partner_id": self.partner.id,
+                "currency_id": self.company.currency_id.id,
+            }
+        )
+        operation.action_start()
+        self.assertEqual(operation.line_ids.mapped("step"), [1, 2, 3])
+        operation.action_next_step()
+        parent_line = operation.line_ids[0]
+        operation_2 = parent_line.created_operation_id
+        self.assertEqual(operation_2.parent_line_id, parent_line)
+        self.assertFalse(operation_2.line_ids.orig_line_id)
+        self.assertEqual(operation_2.line_ids.dest_line_id, parent_line)
+        self.assertEqual(parent_line.orig_line_id, operation_2.line_ids)
+        self.assertEqual(parent_line.dest_line_id, operation.line_ids[1])
+        self.assertEqual(operation.line_ids[1].orig_line_id, parent_line)
+
+    def test_09_post_moves_batch(self):
+        operations = self.operation_obj.create(
+            [
+                {
+                    "operation_type_id": self.operation_type.id,
+                    "partner_id": self.partner.id,
+                    "currency_id": self.company.currency_id.id,
+                }
+                for _i in range(2)
+            ]
+        )
+        operations.action_start()
+        first_lines = operations.line_ids.filtered(lambda line: line.step == 1)
+        moves = self.env["account.move"]
+        for line in first_lines:
+            move = self.init_invoice("out_invoice", partner=self.partner, amounts=[10.0])
+            line.write({"move_id": move.id, "state": "in_progress"})
+            moves |= move
+        unrelated_move = self.init_invoice("out_invoice", partner=self.partner, amounts=[10.0])
+        (moves | unrelated_move).action_post()
+        self.assertEqual(set(first_lines.mapped("state")), {"done"})
+        self.assertEqual(set(first_lines.dest_line_id.mapped("state")), {"ready"})
+
+    def test_10_operation_names_block(self):
+        sequence = self.env.ref("account_move_operation.seq_account_move_operation")
+        operations = self.operation_obj.create(
+            [
+                {
+                    "operation_type_id": self.operation_type.id,
+                    "currency_id": self.company.currency_id.id,
+                    "company_id": self.company.id,
+                }
+                for _i in range(3)
+            ]
+        )
+        numbers = [int(name.removeprefix(sequence.prefix)) for name in operations.mapped("name")]
+        self.assertEqual(numbers, list(range(numbers[0], numbers[0] + 3)))
+
+        sequence.implementation = "no_gap"
+        operations = self.operation_obj.create(
+            [
+                {
+                    "operation_type_id": self.operation_type.id,
+                    "currency_id": self.company.currency_id.id,
+                }
+                for _i in range(2)
+            ]
+        )
+        numbers = [int(name.removeprefix(sequence.prefix)) for name in operations.mapped("name")]
+        self.assertEqual(numbers, list(range(numbers[0], numbers[0] + 2)))
+        self.assertEqual(sequence.number_next_actual, numbers[-1] + 1)
+
+    def test_11_run_auto_steps(self):
+        operation = self.operation_obj.create(
+            {
+                "operation_type_id": self.operation_type_2.id,
+                "partner_id": self.partner.id,
+                "currency_id": self.company.currency_id.id,
+            }
+        )
+        operation.action_start()
+        executed_lines = operation._run_auto_steps()
+        operation_2 = operation.line_ids[0].created_operation_id
+        self.assertTrue(operation_2)
+        self.assertEqual(executed_lines, operation.line_ids[:2] | operation_2.line_ids)
+        self.assertEqual(operation_2.state, "done")
+        self.assertTrue(operation_2.line_ids.move_id)
+        self.assertEqual(operation_2.line_ids.move_id.operation_id, operation_2)
+        self.assertEqual(operation.line_ids[1].move_id.operation_id, operation)
+        self.assertEqual(
+            operation.last_document_date, operation.line_ids[1].move_id.date
+        )
+        self.assertRecordValues(
+            operation.line_ids,
+            [
+                {"state": "done", "action": "operation"},
+                {"state": "done", "action": "move"},
+                {"state": "ready", "action": "pay"},
+            ],
+        )
+
+        manual_operation = self.operation_obj.create(
+            {
+                "operation_type_id": self.operation_type_3.id,
+                "partner_id": self.partner.id,
+                "currency_id": self.company.currency_id.id,
+            }
+        )
+        manual_operation.action_start()
+        self.assertFalse(manual_operation._run_auto_steps())
+
+    def test_12_background_jobs(self):
+        operations = self.operation_obj.create(
+            [
+                {
+                    "operation_type_id": self.operation_type.id,
+                    "partner_id": partner.id,
+                    "currency_id": self.company.currency_id.id,
+                }
+                for partner in (self.partner, self.partner2, self.env["res.partner"])
+            ]
+        )
+        operations.action_start_in_background()
+        jobs = operations.job_ids
+        self.assertEqual(set(jobs.mapped("state")), {"pending"})
+        self.env["account.move.operation.job"]._cron_process_jobs()
+        self.assertEqual(operations[:2].mapped("state"), ["in_progress", "in_progress"])
+        self.assertEqual(operations[2].state, "draft")
+        self.assertEqual(jobs[:2].mapped("state"), ["done", "done"])
+        self.assertRecordValues(jobs[2], [{"state": "pending", "attempts": 1}])
+        self.assertGreater(jobs[2].date_next_attempt, jobs[2].create_date)
+        self.assertIn("Please set a partner", jobs[2].error)
+        self.assertIn("Traceback", jobs[2].error)
+
+    def test_13_idempotent_steps(self):
+        operation = self.operation_obj.create(
+            {
+                "operation_type_id": self.operation_type_2.id,
+                "partner_id": self.partner.id,
+                "currency_id": self.company.currency_id.id,
+            }
+        )
+        operation.action_start()
+        self.assertEqual(operation._try_lock(), operation)
+        operation._run_auto_steps()
+        move_line = operation.line_ids[1]
+        move = move_line.move_id
+        self.assertTrue(move)
+        self.assertFalse(move_line._run_step())
+        self.assertEqual(move_line.move_id, move)
+        move_line.action_done()
+        self.assertRecordValues(
+            operation.line_ids,
+            [
+                {"state": "done", "action": "operation"},
+                {"state": "done", "action": "move"},
+                {"state": "ready", "action": "pay"},
+            ],
+        )
+
+    def test_14_operation_type_plan(self):
+        plan = self.operation_type._get_plan()
+        self.assertEqual(
+            [plan_step.action for plan_step in plan], ["move", "reconcile", "move", "pay"]
+        )
+        self.assertIs(self.operation_type._get_plan(), plan)
+        self.operation_type.action_ids[1].active = False
+        plan = self.operation_type._get_plan()
+        self.assertEqual([plan_step.action for plan_step in plan], ["move", "move", "pay"])
+        operation = self.operation_obj.create(
+            {
+                "operation_type_id": self.operation_type.id,
+                "partner_id": self.partner.id,
+                "currency_id": self.company.currency_id.id,
+            }
+        )
+        operation.action_start()
+        self.assertEqual(
+            operation.line_ids.action_id.ids, [plan_step.action_id for plan_step in plan]
+        )
+        first_line = operation.line_ids[0]
+        self.assertEqual(first_line._get_plan_step(), plan[0])
+        self.assertTrue(first_line._is_auto_step())
+        first_line.action_id.auto = False
+        self.assertFalse(first_line._get_plan_step().auto)
+        self.assertFalse(first_line._is_auto_step())
+
+    def test_15_direct_move_builder(self):
+        operations = self.operation_obj.create(
+            [
+                {
+                    "operation_type_id": self.operation_type.id,
+                    "partner_id": self.partner.id,
+                    "currency_id": self.company.currency_id.id,
+                    "amount": amount,
+                }
+                for amount in (100.0, 250.0)
+            ]
+        )
+        operations.action_start()
+        lines = operations.line_ids.filtered(lambda line: line.step == 1)
+        wizard = (
+            self.env["account.move.template.run"]
+            .with_context(lines[0]._get_template_run_context())
+            .create(lines[0]._get_template_run_vals())
+        )
+        wizard.load_lines()
+        wizard_move = wizard.create_move()
+
+        lines._create_moves()
+        self.assertEqual(set(lines.mapped("state")), {"done"})
+        self.assertEqual(len(lines.move_id), 2)
+        move = lines[0].move_id
+        for field_name in ("move_type", "journal_id", "partner_id", "ref", "state"):
+            self.assertEqual(move[field_name], wizard_move[field_name])
+        self.assertEqual(move.date, wizard_move.date)
+        self.assertEqual(move.currency_id, wizard_move.currency_id)
+
+        def get_line_values(aml):
+            return (
+                aml.account_id,
+                aml.partner_id,
+                aml.name,
+                aml.tax_ids,
+                aml.date,
+                aml.currency_id,
+                aml.debit,
+                aml.credit,
+            )
+
+        self.assertEqual(
+            move.line_ids.mapped(get_line_values),
+            wizard_move.line_ids.mapped(get_line_values),
+        )
+
+    def test_16_template_lines_batch(self):
+        template = self.env.ref("account_move_operation.template_cash_return_customer_invoice")
+        currency = self.company.currency_id
+        input_line = template.line_ids[:1]
+        computed_line = self.env["account.move.template.line"].create(
+            {
+                "template_id": template.id,
+                "sequence": input_line.sequence + 1,
+                "name": "Tax",
+                "account_id": input_line.account_id.id,
+                "move_line_type": "dr",
+                "type": "computed",
+                "python_code": "L%s * 0.16" % input_line.sequence,
+            }
+        )
+        sets_list = [{input_line.sequence: amount} for amount in (10.0, 33.33, 0.125)]
+        amounts_list = template._compute_lines_batch(sets_list, currency)
+        self.assertEqual(
+            amounts_list, template._compute_lines_one_by_one(sets_list, currency)
+        )
+        self.assertAlmostEqual(amounts_list[1][computed_line.sequence], 5.33)
+
+    def test_17_latest_documents_batch(self):
+        operations = self.operation_obj.create(
+            [
+                {
+                    "operation_type_id": self.operation_type_2.id,
+                    "partner_id": self.partner.id,
+                    "currency_id": self.company.currency_id.id,
+                }
+                for _i in range(2)
+            ]
+        )
+        operations.action_start()
+        operations._run_auto_steps()
+        pay_lines = operations.line_ids.filtered(lambda line: line.action == "pay")
+        moves = pay_lines._get_latest_moves()
+        dates = pay_lines._get_latest_document_dates()
+        for pay_line in pay_lines:
+            move_line = pay_line.orig_line_id
+            self.assertEqual(moves[pay_line.id], move_line.move_id)
+            self.assertEqual(dates[pay_line.id], move_line.move_id.date)
+            self.assertEqual(pay_line._get_latest_move(), move_line.move_id)
+
+        sub_lines = operations.line_ids.created_operation_id.line_ids
+        operation_lines = operations.line_ids.filtered(lambda line: line.action == "operation")
+        moves = operation_lines._get_latest_moves()
+        for operation_line in operation_lines:
+            self.assertEqual(
+                moves[operation_line.id],
+                sub_lines.filtered(lambda line: line.dest_line_id == operation_line).move_id,
+            )
+
+        # The first step has no previous step to read from
+        first_line = operations[0].line_ids[0]
+        self.assertFalse(first_line.orig_line_id._get_latest_move())
+        self.assertFalse(first_line.orig_line_id._get_latest_document_date())
+
+    def test_18_cancel_operations_batch(self):
+        operations = self.operation_obj.create(
+            [
+                {
+                    "operation_type_id": operation_type.id,
+                    "partner_id": self.partner.id,
+                    "currency_id": self.company.currency_id.id,
+                }
+                for operation_type in (self.operation_type_2, self.operation_type_2, self.operation_type)
+            ]
+        )
+        operations.action_start()
+        for operation in operations[:2]:
+            operation.action_next_step()
+        sub_operations = operations.line_ids.created_operation_id
+        self.assertEqual(len(sub_operations), 2)
+        self.assertEqual(operations[:2]._get_cancel_tree(), operations[:2] | sub_operations)
+        operations[:2].action_cancel()
+        self.assertEqual(set((operations[:2] | sub_operations).mapped("state")), {"cancel"})
+        self.assertEqual(
+            set((operations[:2] | sub_operations).line_ids.mapped("state")), {"cancel"}
+        )
+        self.assertEqual(operations[2].state, "in_progress")
+
+    def test_19_cancel_and_reverse_documents(self):
+        operations = self.operation_obj.create(
+            [
+                {
+                    "operation_type_id": self.operation_type_2.id,
+                    "partner_id": self.partner.id,
+                    "currency_id": self.company.currency_id.id,
+                    "amount": 100.0,
+                }
+                for _i in range(2)
+            ]
+        )
+        operations.action_start()
+        operations._run_auto_steps()
+        moves = (operations | operations.line_ids.created_operation_id).line_ids.move_id
+        self.assertEqual(len(moves), 4)
+        posted_moves = moves.filtered(lambda move: move.state == "posted")
+        draft_moves = moves - posted_moves
+        operations.action_cancel_and_reverse()
+        self.assertEqual(set(operations.mapped("state")), {"cancel"})
+        self.assertEqual(set(draft_moves.mapped("state")), {"cancel"})
+        self.assertEqual(set(posted_moves.mapped("payment_state")), {"reversed"})
+
+    def test_20_done_lines_batch(self):
+        operations = self.operation_obj.create(
+            [
+                {
+                    "operation_type_id": self.operation_type_2.id,
+                    "partner_id": self.partner.id,
+                    "currency_id": self.company.currency_id.id,
+                }
+                for _i in range(10)
+            ]
+        )
+        operations.action_start()
+        for operation in operations:
+            operation.action_next_step()
+        sub_operations = operations.line_ids.created_operation_id
+        self.assertEqual(len(sub_operations), 10)
+        self.env.flush_all()
+        self.env.invalidate_all()
+        queries_before = self.cr.sql_log_count
+        sub_operations.with_context(tracking_disable=True).line_ids.action_done()
+        self.env.flush_all()
+        batch_count = self.cr.sql_log_count - queries_before
+        self.assertLess(batch_count, 30)
+        self.assertEqual(set(sub_operations.mapped("state")), {"done"})
+        self.assertRecordValues(
+            operations.line_ids.filtered(lambda line: line.step == 1),
+            [{"state": "done"}] * 10,
+        )
+        self.assertRecordValues(
+            operations.line_ids.filtered(lambda line: line.step == 2),
+            [{"state": "ready"}] * 10,
+        )
+        self.assertEqual(set(operations.mapped("state")), {"in_progress"})
+
+    def test_21_progress(self):
+        operation = self.operation_obj.create(
+            {
+                "operation_type_id": self.operation_type_3.id,
+                "partner_id": self.partner.id,
+                "currency_id": self.company.currency_id.id,
+            }
+        )
+        self.assertRecordValues(
+            operation,
+            [{"current_line_id": False, "step_count": 0, "progress": 0.0}],
+        )
+        operation.action_start()
+        first_line, second_line = operation.line_ids[:2]
+        self.assertRecordValues(
+            operation,
+            [
+                {
+                    "current_line_id": first_line.id,
+                    "step_count": 4,
+                    "step_done_count": 0,
+                    "progress": 0.0,
+                }
+            ],
+        )
+        self.assertTrue(operation.date_last_transition)
+        past = fields.Datetime.subtract(operation.date_last_transition, days=1)
+        operation.date_last_transition = past
+        first_line.write({"state": "ready"})
+        self.assertEqual(operation.date_last_transition, past)
+        first_line.action_done()
+        self.assertGreater(operation.date_last_transition, past)
+        self.assertRecordValues(
+            operation,
+            [
+                {
+                    "current_line_id": second_line.id,
+                    "step_done_count": 1,
+                    "progress": 25.0,
+                }
+            ],
+        )
+        self.assertEqual(
+            self.operation_obj.search(
+                [("id", "=", operation.id), ("progress", ">", 20.0)]
+            ),
+            operation,
+        )
+
+    def test_22_last_document_date(self):
+        operation = self.operation_obj.create(
+            {
+                "operation_type_id": self.operation_type_2.id,
+                "partner_id": self.partner.id,
+                "currency_id": self.company.currency_id.id,
+            }
+        )
+        operation.action_start()
+        operation._run_auto_steps()
+        sub_operation = operation.line_ids.created_operation_id
+        sub_move = sub_operation.line_ids.move_id
+        self.assertEqual(sub_operation.last_document_date, sub_move.date)
+
+        move_line = operation.line_ids.filtered(lambda line: line.action == "move")
+        self.assertEqual(operation.last_document_date, move_line.move_id.date)
+
+        operation.last_document_date = "2020-01-15"
+        move_line.date_last_document = True
+        self.assertEqual(
+            str(move_line._get_template_run_vals()["date"]), "2020-01-15"
+        )
+
+    def test_23_move_operation_link(self):
+        operation = self.operation_obj.create(
+            {
+                "operation_type_id": self.operation_type_2.id,
+                "partner_id": self.partner.id,
+                "currency_id": self.company.currency_id.id,
+            }
+        )
+        operation.action_start()
+        operation._run_auto_steps()
+        sub_operation = operation.line_ids.created_operation_id
+        self.assertEqual(sub_operation.line_ids.move_id.operation_id, sub_operation)
+        move = operation.line_ids.move_id
+        self.assertEqual(move.operation_id, operation)
+
+        other_operation = operation.copy()
+        other_operation.action_start()
+        other_operation.line_ids[:1].write({"move_id": move.id})
+        self.assertEqual(move.operation_id, operation)
+
+    def test_24_create_operations_from_entries(self):
+        moves = self.env["account.move"]
+        for _i in range(3):
+            moves |= self.init_invoice(
+                "out_invoice", partner=self.partner, amounts=[10.0], post=True
+            )
+        action = moves.action_create_operation()
+        self.assertEqual(action["res_model"], "account.move.operation.from.entry.batch")
+        wizard = (
+            self.env[action["res_model"]]
+            .with_context(**action["context"])
+            .create({"operation_type_id": self.operation_type.id})
+        )
+        self.assertEqual(wizard.move_ids, moves)
+        action = wizard.action_create_operations()
+        operations = self.operation_obj.search(action["domain"])
+        self.assertEqual(len(operations), 3)
+        self.assertEqual(moves.operation_id, operations)
+        self.assertRecordValues(
+            operations.line_ids.filtered(lambda line: line.step == 1),
+            [{"state": "done", "move_id": move.id} for move in moves],
+        )
+        self.assertRecordValues(
+            operations.line_ids.filtered(lambda line: line.step == 2),
+            [{"state": "ready"}] * 3,
+        )
+
+        with self.assertRaises(UserError):
+            wizard.action_create_operations()
+
+    def test_25_match_entries_to_steps(self):
+        from_entry = self.env["account.move.operation.from.entry"]
+        self.operation_type.action_ids.filtered(lambda action: action.action == "move")[
+            1:
+        ].match_move_type = "in_invoice"
+        plan = self.operation_type._get_plan()
+        self.assertEqual(plan[2].match_move_type, "in_invoice")
+        self.assertTrue(plan[3].match_payment)
+        index = from_entry._get_match_index(plan)
+
+        bill = self.init_invoice("in_invoice", partner=self.partner, amounts=[10.0])
+        invoice = self.init_invoice("out_invoice", partner=self.partner, amounts=[10.0])
+        self.assertEqual(from_entry._match_step(bill, index), 3)
+        self.assertEqual(from_entry._match_step(invoice, index), 1)
+
+    def test_26_start_with_completed_steps(self):
+        moves = self.env["account.move"]
+        for _i in range(2):
+            moves |= self.init_invoice(
+                "out_invoice", partner=self.partner, amounts=[10.0], post=True
+            )
+        operations = self.operation_obj.create(
+            [
+                {
+                    "operation_type_id": self.operation_type.id,
+                    "partner_id": self.partner.id,
+                    "currency_id": self.company.currency_id.id,
+                }
+                for _i in range(2)
+            ]
+        )
+        operations._start(
+            {
+                operation.id: {1: {"move_id": move.id}}
+                for operation, move in zip(operations, moves)
+            }
+        )
+        for operation, move in zip(operations, moves):
+            self.assertRecordValues(
+                operation.line_ids,
+                [
+                    {"step": 1, "state": "done", "move_id": move.id},
+                    {"step": 2, "state": "ready", "move_id": False},
+                    {"step": 3, "state": "waiting", "move_id": False},
+                    {"step": 4, "state": "waiting", "move_id": False},
+                ],
+            )
+            self.assertEqual(operation.current_line_id, operation.line_ids[1])
+        self.assertEqual(moves.operation_id, operations)
+
+    def test_27_create_operations_from_statement_lines(self):
+        self.operation_type.write(
+            {
+                "from_bank_statement": True,
+                "st_label_pattern": "^cash return",
+                "st_amount_max": 500.0,
+            }
+        )
+        # Sub operations are only started from another operation
+        self.operation_type.copy(
+            {"sub_operation": True, "sequence": self.operation_type.sequence - 1}
+        )
+        matching_lines = self.env["account.bank.statement.line"]
+        for _i in range(3):
+            matching_lines |= self._create_st_line(
+                100.0, partner_id=self.partner.id, payment_ref="Cash Return"
+            )
+        other_lines = self._create_st_line(
+            1000.0, partner_id=self.partner.id, payment_ref="Cash Return"
+        )
+        other_lines |= self._create_st_line(
+            100.0, partner_id=self.partner.id, payment_ref="Rent"
+        )
+        other_lines |= self._create_st_line(100.0, payment_ref="Cash Return")
+
+        operations = (matching_lines | other_lines)._create_operations()
+        self.assertEqual(operations.st_line_id, matching_lines)
+        self.assertEqual(operations.operation_type_id, self.operation_type)
+        self.assertEqual(set(operations.mapped("state")), {"in_progress"})
+        self.assertFalse((matching_lines | other_lines)._create_operations())
+
+        with self.assertRaises(ValidationError):
+            self.operation_type.st_label_pattern = "(cash"
+
+    def test_28_statement_line_candidates(self):
+        operations = self.operation_obj.create(
+            [
+                {
+                    "operation_type_id": self.operation_type.id,
+                    "partner_id": self.partner.id,
+                    "currency_id": self.company.currency_id.id,
+                    "amount": amount,
+                }
+                for amount in (80.0, 100.0, 300.0)
+            ]
+        )
+        other_operation = self.operation_obj.create(
+            {
+                "operation_type_id": self.operation_type.id,
+                "partner_id": self.partner2.id,
+                "currency_id": self.company.currency_id.id,
+                "amount": 100.0,
+            }
+        )
+        st_line = self._create_st_line(
+            100.0, partner_id=self.partner.id, date=operations[0].date
+        )
+        other_st_line = self._create_st_line(
+            100.0, partner_id=self.partner2.id, date=operations[0].date
+        )
+        candidates = st_line._get_operation_candidates()
+        self.assertEqual(candidates, operations[1] | operations[0] | operations[2])
+        self.assertEqual(candidates[0], operations[1])
+        suggestions = (st_line | other_st_line).get_operation_suggestions(limit=1)
+        self.assertEqual(
+            [suggestion["id"] for suggestion in suggestions[st_line.id]],
+            operations[1].ids,
+        )
+        self.assertEqual(
+            [suggestion["id"] for suggestion in suggestions[other_st_line.id]],
+            other_operation.ids,
+        )
+        self.assertEqual(operations[1].st_line_candidate_ids, st_line)
+
+        action = st_line.action_link_operation(operations[1].id)
+        self.assertEqual(action["res_id"], operations[1].id)
+        self.assertEqual(operations[1].st_line_id, st_line)
+        with self.assertRaises(UserError):
+            st_line.action_link_operation(operations[1].id)
+        self.assertEqual(st_line._get_operation_candidates()[0], operations[0])
+        self.assertFalse(operations[0].st_line_candidate_ids)
+
+    def test_29_reconcile_steps_batch(self):
+        st_lines = self.env["account.bank.statement.line"]
+        for _i in range(2):
+            st_lines |= self._create_st_line(
+                1000.0,
+                partner_id=self.partner.id,
+                journal_id=self.journal_bank.id,
+                company_id=self.company.id,
+            )
+        operations = self.operation_obj.create(
+            [
+                {
+                    "operation_type_id": self.operation_type_3.id,
+                    "partner_id": self.partner.id,
+                    "currency_id": self.company.currency_id.id,
+                    "amount": 1000.0,
+                    "st_line_id": st_line.id,
+                }
+                for st_line in st_lines
+            ]
+        )
+        operations.action_start()
+        invoice_lines = operations.line_ids.filtered(lambda line: line.step == 1)
+        invoice_lines._create_moves()
+        reconcile_lines = operations.line_ids.filtered(lambda line: line.step == 2)
+        self.assertRecordValues(reconcile_lines, [{"state": "ready"}] * 2)
+
+        # Draft entries are not reconciled
+        invoice_lines.move_id.filtered(lambda move: move.state == "posted").button_draft()
+        operations.action_reconcile_ready_steps()
+        self.assertRecordValues(reconcile_lines, [{"state": "ready"}] * 2)
+        self.assertFalse(any(st_lines.mapped("is_reconciled")))
+        invoice_lines.move_id.action_post()
+
+        operations.action_reconcile_ready_steps()
+        self.assertRecordValues(
+            reconcile_lines,
+            [{"state": "done", "st_line_id": st_line.id} for st_line in st_lines],
+        )
+        self.assertTrue(all(st_lines.mapped("is_reconciled")))
+        self.assertRecordValues(
+            operations.line_ids.filtered(lambda line: line.step == 3),
+            [{"state": "ready"}] * 2,
+        )
+
+    def test_30_register_payments_batch(self):
+        bills = self.env["account.move"]
+        for _i in range(2):
+            bills |= self.init_invoice(
+                "in_invoice", partner=self.partner, amounts=[100.0], post=True
+            )
+        operations = self.operation_obj.create(
+            [
+                {
+                    "operation_type_id": self.operation_type_3.id,
+                    "partner_id": self.partner.id,
+                    "currency_id": self.company.currency_id.id,
+                }
+                for _i in range(2)
+            ]
+        )
+        operations._start(
+            {
+                operation.id: {3: {"move_id": bill.id}}
+                for operation, bill in zip(operations, bills)
+            }
+        )
+        for operation, bill in zip(operations, bills):
+            self.assertRecordValues(
+                operation.line_ids,
+                [
+                    {"step": 1, "state": "done", "move_id": False},
+                    {"step": 2, "state": "done", "move_id": False},
+                    {"step": 3, "state": "done", "move_id": bill.id},
+                    {"step": 4, "state": "ready", "move_id": False},
+                ],
+            )
+            self.assertEqual(operation.current_line_id, operation.line_ids[3])
+        pay_lines = operations.line_ids.filtered(lambda line: line.action == "pay")
+
+        operations.action_register_payments(group_payment=True)
+        self.assertRecordValues(pay_lines, [{"state": "done"}] * 2)
+        self.assertEqual(len(pay_lines.payment_id), 1)
+        for bill in bills:
+            self.assertIn(bill.payment_state, ("in_payment", "paid"))
+        action = operations.action_register_payments()
+        self.assertEqual(action["params"]["type"], "warning")
+
+    def test_31_done_consecutive_lines(self):
+        operation = self.operation_obj.create(
+            {
+                "operation_type_id": self.operation_type_3.id,
+                "partner_id": self.partner.id,
+                "currency_id": self.company.currency_id.id,
+            }
+        )
+        operation.action_start()
+        operation.line_ids[:2].action_done()
+        self.assertRecordValues(
+            operation.line_ids,
+            [
+                {"step": 1, "state": "done"},
+                {"step": 2, "state": "done"},
+                {"step": 3, "state": "ready"},
+                {"step": 4, "state": "waiting"},
+            ],
+        )
+        self.assertEqual(operation.state, "in_progress")
+        operation.line_ids[2:].action_done()
+        self.assertEqual(set(operation.line_ids.mapped("state")), {"done"})
+        self.assertEqual(operation.state, "done")
+
+    def test_32_cancel_requires_write_access(self):
+        operation = self.operation_obj.create(
+            {
+                "operation_type_id": self.operation_type.id,
+                "partner_id": self.partner.id,
+                "currency_id": self.company.currency_id.id,
+            }
+        )
+        operation.action_start()
+        user = new_test_user(self.env, login="readonly_accountant", groups="base.group_user")
+        with self.assertRaises(AccessError):
+            operation.with_user(user).action_cancel()
+        self.assertEqual(operation.state, "in_progress")
+
+    def test_33_cancel_and_reverse_sub_operation(self):
+        operation = self.operation_obj.create(
+            {
+                "operation_type_id": self.operation_type_2.id,
+                "partner_id": self.partner.id,
+                "currency_id": self.company.currency_id.id,
+                "amount": 100.0,
+            }
+        )
+        operation.action_start()
+        operation.action_next_step()
+        sub_operation = operation.line_ids.created_operation_id
+        parent_invoice = self.init_invoice(
+            "out_invoice", partner=self.partner, amounts=[10.0], post=True
+        )
+        operation.line_ids[:1].write({"move_id": parent_invoice.id})
+
+        sub_operation.action_cancel_and_reverse()
+        self.assertEqual(operation.state, "cancel")
+        self.assertEqual(sub_operation.state, "cancel")
+        self.assertEqual(parent_invoice.state, "posted")
+        self.assertNotEqual(parent_invoice.payment_state, "reversed")
+
+    def test_34_create_operations_from_payment_entries(self):
+        payment = self.env["account.payment"].create(
+            {
+                "partner_id": self.partner.id,
+                "amount": 10.0,
+                "payment_type": "outbound",
+                "partner_type": "supplier",
+                "journal_id": self.company_data["default_journal_bank"].id,
+            }
+        )
+        payment.action_post()
+        entry = payment.move_id
+        self.assertTrue(entry)
+        wizard = self.env["account.move.operation.from.entry.batch"].create(
+            {
+                "move_ids": [Command.set(entry.ids)],
+                "operation_type_id": self.operation_type.id,
+            }
+        )
+        action = wizard.action_create_operations()
+        operation = self.operation_obj.search(action["domain"])
+        self.assertRecordValues(
+            operation.line_ids.filtered(lambda line: line.step == 4),
+            [{"state": "done", "payment_id": payment.id}],
+        )
+        self.assertEqual(entry.operation_id, operation)
+        with self.assertRaises(UserError):
+            wizard.action_create_operations()
+
+    def test_35_plan_follows_template_move_type(self):
+        action = self.operation_type.action_ids.filtered(
+            lambda action: action.action == "move"
+        )[:1]
+        self.assertEqual(
+            self.operation_type._get_plan()[0].match_move_type,
+            action.template_id.move_type,
+        )
+        new_move_type = (
+            "in_invoice" if action.template_id.move_type != "in_invoice" else "out_invoice"
+        )
+        action.template_id.move_type = new_move_type
+        self.assertEqual(self.operation_type._get_plan()[0].match_move_type, new_move_type)
+
+    def test_36_try_lock_skips_operations_locked_elsewhere(self):
+        operation = self.env.ref("account_move_operation.demo_operation_cash_return")
+        with closing(sql_db.db_connect(self.env.cr.dbname).cursor()) as other_cr:
+            other_cr.execute(
+                "SELECT id FROM account_move_operation WHERE id = %s FOR UPDATE",
+                [operation.id],
+            )
+            self.assertFalse(operation._try_lock())
+            job = self.env["account.move.operation.job"].create(
+                {"operation_id": operation.id, "job_type": "start"}
+            )
+            self.env["account.move.operation.job"]._cron_process_jobs()
+            self.assertEqual(job.state, "pending")
+            self.assertEqual(operation.state, "draft")
+            other_cr.rollback()
+        self.assertEqual(operation._try_lock(), operation)
+
+    def test_37_several_job_crons(self):
+        job_obj = self.env["account.move.operation.job"]
+        cron = self.env.ref("account_move_operation.ir_cron_account_move_operation_job")
+        other_cron = cron.copy()
+        self.assertEqual(job_obj._get_crons(), cron | other_cron)
+
+    def test_38_operation_statement_line_candidates(self):
+        operation = self.operation_obj.create(
+            {
+                "operation_type_id": self.operation_type.id,
+                "partner_id": self.partner.id,
+                "currency_id": self.company.currency_id.id,
+                "amount": 100.0,
+            }
+        )
+        far_line = self._create_st_line(
+            300.0, partner_id=self.partner.id, date=operation.date
+        )
+        close_line = self._create_st_line(
+            110.0, partner_id=self.partner.id, date=operation.date
+        )
+        exact_line = self._create_st_line(
+            100.0, partner_id=self.partner.id, date=operation.date
+        )
+        self._create_st_line(100.0, date=operation.date)
+        self._create_st_line(100.0, partner_id=self.partner2.id, date=operation.date)
+
+        candidates = operation._get_statement_line_candidates()
+        self.assertEqual(candidates.ids, (exact_line | close_line | far_line).ids)
+        self.assertEqual(operation._get_statement_line_candidates(limit=1), exact_line)
+
+    def test_39_background_jobs_in_chunks(self):
+        self.env["ir.config_parameter"].sudo().set_param(
+            "account_move_operation.job_chunk_size", 1
+        )
+        operations = self.operation_obj.create(
+            [
+                {
+                    "operation_type_id": self.operation_type.id,
+                    "partner_id": partner.id,
+                    "currency_id": self.company.currency_id.id,
+                }
+                for partner in (self.env["res.partner"], self.partner, self.partner2)
+            ]
+        )
+        operations.action_start_in_background()
+        jobs = operations.job_ids
+        with self.assertLogs(
+            "odoo.addons.account_move_operation.models.account_move_operation_job",
+            level="WARNING",
+        ) as logs:
+            self.env["account.move.operation.job"]._cron_process_jobs()
+        self.assertTrue(logs.records[0].exc_info)
+        self.assertEqual(jobs.mapped("state"), ["pending", "done", "done"])
+        self.assertEqual(jobs[0].attempts, 1)
+        self.assertEqual(
+            operations.mapped("state"), ["draft", "in_progress", "in_progress"]
+        )
+
+    def test_40_auto_reconcile_without_posted_entry(self):
+        st_lines = self.env["account.bank.statement.line"]
+        for _i in range(2):
+            st_lines |= self._create_st_line(
+                1000.0,
+                partner_id=self.partner.id,
+                journal_id=self.journal_bank.id,
+                company_id=self.company.id,
+            )
+        operations = self.operation_obj.create(
+            [
+                {
+                    "operation_type_id": self.operation_type.id,
+                    "partner_id": self.partner.id,
+                    "currency_id": self.company.currency_id.id,
+                    "amount": 1000.0,
+                    "st_line_id": st_line.id,
+                }
+                for st_line in st_lines
+            ]
+        )
+        draft_invoice = self.init_invoice(
+            "out_invoice", partner=self.partner, amounts=[1000.0]
+        )
+        # The first step was executed without a document, the second one
+        # with a draft invoice
+        operations._start(
+            {
+                operations[0].id: {1: {}},
+                operations[1].id: {1: {"move_id": draft_invoice.id}},
+            }
+        )
+        reconcile_lines = operations.line_ids.filtered(lambda line: line.step == 2)
+        self.assertRecordValues(reconcile_lines, [{"state": "ready"}] * 2)
+
+        self.assertFalse(operations._run_auto_steps())
+        self.assertRecordValues(reconcile_lines, [{"state": "ready"}] * 2)
+        self.assertFalse(any(st_lines.mapped("is_reconciled")))
+
+    def test_41_last_document_date_from_latest_step(self):
+        operations = self.operation_obj.create(
+            [
+                {
+                    "operation_type_id": self.operation_type_3.id,
+                    "partner_id": self.partner.id,
+                    "currency_id": self.company.currency_id.id,
+                }
+                for _i in range(2)
+            ]
+        )
+        moves = self.env["account.move"]
+        for move_type, invoice_date in (
+            ("in_invoice", "2024-01-10"),
+            ("out_invoice", "2024-03-10"),
+            ("in_invoice", "2024-01-10"),
+        ):
+            moves |= self.init_invoice(
+                move_type, partner=self.partner, amounts=[100.0], invoice_date=invoice_date
+            )
+        operations._start(
+            {
+                operations[0].id: {3: {"move_id": moves[0].id}},
+                operations[1].id: {
+                    1: {"move_id": moves[1].id},
+                    3: {"move_id": moves[2].id},
+                },
+            }
+        )
+        self.assertEqual(operations.mapped("last_document_date"), moves[::2].mapped("date"))
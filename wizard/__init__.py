@@ -6,4 +6,5 @@
 # from . import account_move_operation_reconcile
 from . import account_move_operation_operation
 # from . import account_bank_statement_operation
-from . import account_move_operation_from_entry
\ No newline at end of file
+from . import account_move_operation_from_entry
+from . import account_move_operation_from_entry_batch
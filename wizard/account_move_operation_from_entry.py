@@ -88,18 +88,16 @@ class AccountMoveOperationFromEntry(models.TransientModel):
         if not self.operation_type_id:
             return
 
-        actions = self.operation_type_id.action_ids.filtered(lambda a: a.active)
-
-        matched_action = self._identify_matching_action(actions)
+        plan = self.operation_type_id._origin._get_plan()
+        matched_step = self._match_step(self.move_id, self._get_match_index(plan))
 
         vals_list = []
-        for action in actions:
-            _logger.info("action %s", action.read())
-            is_source = action == matched_action
+        for step, plan_step in enumerate(plan, 1):
+            is_source = step == matched_step
             vals_list.append(
                 {
-                    "action_id": action.id,
-                    "name": action.name,
+                    "action_id": plan_step.action_id,
+                    "name": plan_step.name,
                     "executed": is_source,
                     "document_id": self.move_id.id if is_source else False,
                 }
@@ -108,55 +106,28 @@ class AccountMoveOperationFromEntry(models.TransientModel):
 
         self.action_line_ids = [(0, 0, vals) for vals in vals_list]
 
-    def _identify_matching_action(self, actions):
-        """Try to identify which action matches our source document"""
-        self.ensure_one()
-        move = self.move_id
-
-        move_type = move.move_type
-        if move_type in ("out_invoice", "in_invoice", "out_refund", "in_refund"):
-            for action in actions.filtered(lambda a: a.action == "move"):
-                if action.template_id:
-                    template_name = action.template_id.name.lower()
-                    if (
-                        (
-                            move_type == "out_invoice"
-                            and ("customer" in template_name or "sale" in template_name)
-                        )
-                        or (
-                            move_type == "in_invoice"
-                            and (
-                                "vendor" in template_name or "purchase" in template_name
-                            )
-                        )
-                        or (
-                            move_type == "out_refund"
-                            and (
-                                "credit" in template_name
-                                and (
-                                    "customer" in template_name
-                                    or "sale" in template_name
-                                )
-                            )
-                        )
-                        or (
-                            move_type == "in_refund"
-                            and (
-                                "credit" in template_name
-                                and (
-                                    "vendor" in template_name
-                                    or "purchase" in template_name
-                                )
-                            )
-                        )
-                    ):
-                        return action
-
-        if self.env["account.payment"].name_search(move.name, [], "like", limit=1):
-            for action in actions.filtered(lambda a: a.action == "pay"):
-                return action
-
-        return actions.filtered(lambda a: a.action == "move")[:1]
+    @api.model
+    def _get_match_index(self, plan):
+        """Map what an existing entry can be to the first step of ``plan`` that
+        declares it: a move type, ``"payment"``, or ``None`` for the first
+        journal entry step, used when nothing else matches."""
+        index = {}
+        for step, plan_step in enumerate(plan, 1):
+            if plan_step.match_payment:
+                index.setdefault("payment", step)
+            if plan_step.match_move_type:
+                index.setdefault(plan_step.match_move_type, step)
+            if plan_step.action == "move":
+                index.setdefault(None, step)
+        return index
+
+    @api.model
+    def _match_step(self, move, index):
+        """Return the step of the plan indexed in ``index`` that would have
+        created ``move``"""
+        if move.origin_payment_id and "payment" in index:
+            return index["payment"]
+        return index.get(move.move_type) or index.get(None)
 
     def action_create_operation(self):
         """Create an operation and initialize it with our existing document"""
@@ -185,25 +156,22 @@ class AccountMoveOperationFromEntry(models.TransientModel):
 
         operation = self.env["account.move.operation"].create(operation_vals)
 
-        operation.action_start()
-
-        for wizard_line in self.action_line_ids.filtered(lambda l: l.executed):
-            operation_line = operation.line_ids.filtered(
-                lambda l: l.action_id.id == wizard_line.action_id.id
-            )
-            if operation_line:
-                if wizard_line.action_id.action == "move":
-                    operation_line.move_id = wizard_line.document_id.id
-                elif wizard_line.action_id.action == "pay":
-                    operation_line.payment_id = wizard_line.document_id.id
-
-                operation_line.state = "done"
-
-                next_line = operation.line_ids.filtered(
-                    lambda l: l.orig_line_id.id == operation_line.id
-                )
-                if next_line:
-                    next_line.state = "ready"
+        step_by_action = {
+            plan_step.action_id: step
+            for step, plan_step in enumerate(self.operation_type_id._get_plan(), 1)
+        }
+        done_steps = {}
+        for wizard_line in self.action_line_ids.filtered("executed"):
+            step = step_by_action.get(wizard_line.action_id.id)
+            if not step:
+                continue
+
+            document = wizard_line.document_id
+            if wizard_line.action_id.action == "pay":
+                done_steps[step] = {"payment_id": document.origin_payment_id.id}
+            else:
+                done_steps[step] = {"move_id": document.id}
+        operation._start({operation.id: done_steps})
 
         return {
             "name": _("Account Operation"),
@@ -0,0 +1,108 @@
+from odoo import _, api, fields, models
+from odoo.exceptions import UserError, ValidationError
+from odoo.fields import Command
+
+
+class AccountMoveOperationFromEntryBatch(models.TransientModel):
+    _name = "account.move.operation.from.entry.batch"
+    _description = "Start Operations From Existing Entries"
+
+    move_ids = fields.Many2many(
+        "account.move",
+        string="Source Entries",
+        required=True,
+    )
+    operation_type_id = fields.Many2one(
+        "account.move.operation.type",
+        string="Operation Type",
+        required=True,
+        domain="[('company_id', 'in', (company_id, False)), ('sub_operation', '=', False)]",
+    )
+    company_id = fields.Many2one(
+        "res.company",
+        string="Company",
+        required=True,
+        default=lambda self: self.env.company,
+    )
+
+    @api.model
+    def default_get(self, fields_list):
+        res = super().default_get(fields_list)
+        if self.env.context.get(
+            "active_model"
+        ) == "account.move" and self.env.context.get("active_ids"):
+            moves = self.env["account.move"].browse(self.env.context["active_ids"])
+            res.update(
+                {
+                    "move_ids": [Command.set(moves.ids)],
+                    "company_id": moves.company_id[:1].id or self.env.company.id,
+                }
+            )
+        return res
+
+    def action_create_operations(self):
+        """Create one operation per entry, with the step matching the entry
+        already done"""
+        self.ensure_one()
+        moves = self.move_ids.filtered(lambda move: not move.operation_id)
+        if not moves:
+            raise UserError(_("All the selected entries already belong to an operation."))
+
+        moves_without_partner = moves.filtered(lambda move: not move.partner_id)
+        if moves_without_partner:
+            raise ValidationError(
+                _(
+                    "The following entries have no partner: %s",
+                    ", ".join(moves_without_partner.mapped("name")),
+                )
+            )
+
+        type_company = self.operation_type_id.company_id
+        if type_company and moves.company_id != type_company:
+            raise ValidationError(
+                _(
+                    "Operations of type %(type)s can only be created from entries "
+                    "of %(company)s.",
+                    type=self.operation_type_id.display_name,
+                    company=type_company.name,
+                )
+            )
+
+        plan = self.operation_type_id._get_plan()
+        from_entry = self.env["account.move.operation.from.entry"]
+        match_index = from_entry._get_match_index(plan)
+
+        operations = self.env["account.move.operation"].create(
+            [
+                {
+                    "operation_type_id": self.operation_type_id.id,
+                    "partner_id": move.partner_id.id,
+                    "reference": move.ref or move.name,
+                    "amount": move.amount_total,
+                    "currency_id": move.currency_id.id,
+                    "company_id": move.company_id.id,
+                }
+                for move in moves
+            ]
+        )
+        completed_steps = {}
+        for operation, move in zip(operations, moves):
+            step = from_entry._match_step(move, match_index)
+            if not step:
+                continue
+
+            if plan[step - 1].action == "pay":
+                completed_steps[operation.id] = {
+                    step: {"payment_id": move.origin_payment_id.id}
+                }
+            else:
+                completed_steps[operation.id] = {step: {"move_id": move.id}}
+        operations._start(completed_steps)
+
+        return {
+            "name": _("Account Operations"),
+            "view_mode": "list,form",
+            "res_model": "account.move.operation",
+            "domain": [("id", "in", operations.ids)],
+            "type": "ir.actions.act_window",
+        }
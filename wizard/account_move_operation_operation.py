@@ -61,20 +61,15 @@ class AccountMoveOperationOperation(models.TransientModel):
             "operation_type_id": op_type.id,
             "partner_id": self.operation_id.partner_id.id,
             "currency_id": self.operation_id.currency_id.id,
+            "parent_line_id": self.line_id.id,
         }
         if self.amount:
             vals["amount"] = self.amount
         operation = operation.sudo().create(vals)
         operation.action_start()
-        if self.line_id.orig_line_id:
-            first_line = operation.line_ids.filtered(lambda ln: not ln.orig_line_id)
-            first_line.write({"orig_line_id": self.line_id.orig_line_id.id})
-        last_line = operation.line_ids.filtered(lambda ln: not ln.dest_line_id)
-        last_line.write({"dest_line_id": self.line_id.id})
         self.line_id.write(
             {
                 "state": "in_progress",
-                "orig_line_id": last_line.id,
                 "created_operation_id": operation.id,
             }
         )